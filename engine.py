@@ -0,0 +1,254 @@
+# A vectorized version of the game engine, which computes the clues for many
+# games at once.
+#
+# Words are represented by their index in `valid.txt` (for guesses) or in
+# `answers.txt` (for secret words). Clues are represented by a base-3 code: each
+# letter is a digit, 'c' being 0, 'i' being 1 and '.' being 2, and the first
+# letter is the most significant digit. The strategies that use the clue table
+# (D95, G3 and MaxClueEntropy) use the same encoding.
+#
+# The clue table computed here is the reference for the rules of the game: both
+# `evaluate.evaluate_once` and the vectorized engine look up the real clues in
+# it, so they cannot disagree. It is saved in CLUE_TABLE_CACHE, in a .npy file
+# named after a hash of the word lists, and memory-mapped read-only: loading it
+# takes milliseconds, and all processes share its pages.
+
+import copy
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+with open("valid.txt", "r") as f:
+    valid_words = f.read().splitlines()
+
+with open("answers.txt", "r") as f:
+    answers = f.read().splitlines()
+
+NUM_CLUES = 3**5
+
+# Directory where the clue table is saved (not saved if None)
+CLUE_TABLE_CACHE = "cache"
+# Bump this when changing the rules of the game, so the saved tables are not used
+CLUE_TABLE_VERSION = 1
+# Number of guesses whose clues are computed at once by `compute_clue_table`
+CLUE_TABLE_CHUNK = 256
+
+valid_index = {word: i for i, word in enumerate(valid_words)}
+answer_index = {word: i for i, word in enumerate(answers)}
+# answer_guesses[a] is the index in `valid.txt` of the a-th answer
+answer_guesses = np.array([valid_index[word] for word in answers])
+
+# Powers of 3 by which each letter's digit is multiplied in a clue code
+DIGIT_WEIGHTS = 3 ** np.arange(4, -1, -1)
+# clue_digits[code] is the (5,) array of digits of a clue code
+clue_digits = (np.arange(NUM_CLUES)[:, np.newaxis] // DIGIT_WEIGHTS) % 3
+clue_digits = clue_digits.astype(np.uint8)
+# clue_strings[code] is the clue string corresponding to a clue code
+clue_strings = [''.join("ci."[d] for d in digits) for digits in clue_digits]
+# clue_distances[code1][code2] is the number of letters that differ between two
+# clue codes
+clue_distances = np.sum(
+    clue_digits[:, np.newaxis] != clue_digits[np.newaxis], axis=2, dtype=np.uint8)
+
+def clue_code(clues):
+    """Converts a clue string like 'c.i..' to its base-3 code."""
+    return int(clues.translate(str.maketrans("ci.", "012")), 3)
+
+def letter_array(words):
+    """Returns the (len(words), 5) uint8 array of the letters of `words`."""
+    return np.frombuffer(''.join(words).encode(), dtype=np.uint8).reshape(-1, 5)
+
+def compute_clue_table():
+    """Computes the clues for every guess in `valid.txt` and every answer in
+    `answers.txt`.
+
+    clue_table[guess][answer]: clue code, as a (12972, 2315) uint8 array
+
+    Each letter of the guess gets its clue independently of the others: 'c' if
+    the answer has the same letter at this position, 'i' if it has it at
+    another position, and '.' otherwise. With repeated letters, this differs
+    from the original Wordle, which never gives more 'c' and 'i' clues for a
+    letter than the answer has copies of it (see issue #2).
+    """
+    guess_letters = letter_array(valid_words) - ord("a")
+    answer_letters = letter_array(answers) - ord("a")
+    # Bit l of answer_masks[a] is set if the a-th answer contains letter l
+    answer_masks = np.bitwise_or.reduce(
+        np.left_shift(1, answer_letters, dtype=np.uint32), axis=1)
+    table = np.empty((len(valid_words), len(answers)), dtype=np.uint8)
+    # The guesses are processed in chunks, so the temporary arrays stay small
+    for start in range(0, len(valid_words), CLUE_TABLE_CHUNK):
+        letters = guess_letters[start:start + CLUE_TABLE_CHUNK]
+        chunk = table[start:start + CLUE_TABLE_CHUNK]
+        chunk[:] = NUM_CLUES - 1
+        for i in range(5):
+            letter = letters[:, i, np.newaxis]
+            present = (answer_masks >> letter).astype(np.uint8) & np.uint8(1)
+            correct = (letter == answer_letters[:, i]).view(np.uint8)
+            chunk -= (present + correct) * np.uint8(DIGIT_WEIGHTS[i])
+    return table
+
+def clue_table_path(directory=CLUE_TABLE_CACHE):
+    """Returns the path of the file caching the clue table in `directory`,
+    which depends on the word lists and CLUE_TABLE_VERSION."""
+    key = hashlib.sha256()
+    for part in (CLUE_TABLE_VERSION, valid_words, answers):
+        key.update(repr(part).encode() + b"\0")
+    return Path(directory) / f"clue_table-{key.hexdigest()[:16]}.npy"
+
+def load_clue_table(directory=CLUE_TABLE_CACHE):
+    """Memory-maps the clue table saved in `directory`, computing and saving it
+    first if needed. If `directory` is None or cannot be written, returns the
+    computed table."""
+    if directory is None:
+        return compute_clue_table()
+    path = clue_table_path(directory)
+    if not path.exists():
+        table = compute_clue_table()
+        # Written to a temporary file first, so other processes never load a
+        # partially written table
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary_path, "wb") as f:
+                np.save(f, table)
+            os.replace(temporary_path, path)
+        except OSError:
+            return table
+    return np.load(path, mmap_mode="r")
+
+_clue_table = None
+
+def clue_table():
+    """Returns the clue table, loading it on first use. It is shared by the
+    engine and all strategies, so it is read-only."""
+    global _clue_table
+    if _clue_table is None:
+        _clue_table = load_clue_table()
+        _clue_table.setflags(write=False)
+    return _clue_table
+
+def randomization_probabilities(epsilons, tilt=1.):
+    """Returns the probability that each letter of a clue is replaced by a
+    uniformly random clue, for the given epsilon values: 3/(2+e^(ε/5)).
+
+    If `tilt` is set, this probability is multiplied by it (up to 1), which
+    flips more (if `tilt` > 1) or fewer (if `tilt` < 1) clues than the game
+    does; see `evaluate.evaluate_tilted`.
+    """
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    return np.minimum(tilt * 3. / (2. + np.exp(epsilons / 5)), 1.)
+
+def real_clues(guess, answer):
+    """Returns the clue string of a guess (a word of `valid.txt`) for a secret
+    word of `answers.txt`."""
+    return clue_strings[clue_table()[valid_index[guess], answer_index[answer]]]
+
+def noisy_clue_codes(secrets, guesses, epsilons, rng=None, draws=None, tilt=1.):
+    """Computes the randomized clues for a batch of moves.
+
+    `secrets` are indices in `answers.txt`, `guesses` are indices in
+    `valid.txt`, and `epsilons` are the epsilon values of each move; all three
+    are arrays of the same length. The randomness comes from `draws`, a
+    (2, moves, 5) array of uniform numbers in [0, 1) if set, or is drawn from
+    the `numpy.random.Generator` `rng` all at once otherwise.
+
+    Like in `evaluate.evaluate_once`, letter i of move j is replaced by a
+    uniformly random clue if draws[0, j, i] < 3/(2+e^(ε/5)), the random clue
+    being the digit floor(3 * draws[1, j, i]). If `tilt` is set, the
+    probability of replacing a letter is tilted; see
+    `randomization_probabilities`.
+
+    Returns a uint8 array of noisy clue codes.
+    """
+    secrets = np.asarray(secrets)
+    guesses = np.asarray(guesses)
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    real_digits = clue_digits[clue_table()[guesses, secrets]]
+    if draws is None:
+        draws = rng.random((2,) + real_digits.shape)
+    p_random = randomization_probabilities(epsilons, tilt)
+    randomized = draws[0] < p_random[:, np.newaxis]
+    random_digits = (draws[1] * 3).astype(np.uint8)
+    noisy_digits = np.where(randomized, random_digits, real_digits)
+    return (noisy_digits @ DIGIT_WEIGHTS).astype(np.uint8)
+
+def clue_likelihoods(real_codes, noisy_codes, epsilons, tilt=1.):
+    """Returns the probabilities that `noisy_clue_codes` turns the real clue
+    codes into the noisy clue codes, for the given epsilon values and tilt."""
+    distances = clue_distances[real_codes, noisy_codes]
+    p_other = randomization_probabilities(epsilons, tilt) / 3.
+    p_same = 1. - 2. * p_other
+    return p_same ** (5 - distances) * p_other ** distances
+
+def likelihood_ratios(real_codes, noisy_codes, epsilons, tilt):
+    """Returns the ratios between the probabilities of getting the noisy clue
+    codes in the game and with the given tilt. They only depend on the number
+    of letters that differ between the real and noisy clues."""
+    return (
+        clue_likelihoods(real_codes, noisy_codes, epsilons)
+        / clue_likelihoods(real_codes, noisy_codes, epsilons, tilt)
+    )
+
+class SingleGameAdapter:
+    """Wraps a strategy implementing `first_move` and `next_move` into the
+    batched protocol described in `evaluate.play_batch`.
+
+    Each game is played by its own deep copy of the strategy, except for its
+    read-only arrays (like the clue table and the noise tables), which are
+    shared by all copies.
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+
+    def first_moves(self, n):
+        # Each state is a [strategy, guess, epsilon] list, holding the
+        # strategy copy playing this game and its last move.
+        states = np.empty(n, dtype=object)
+        for i in range(n):
+            strategy = self._copy()
+            states[i] = [strategy, *strategy.first_move()]
+        return self._moves(states)
+
+    def next_moves(self, states, clues):
+        for state, clue in zip(states, clues):
+            strategy, guess, epsilon = state
+            if epsilon > 0:
+                state[1:] = strategy.next_move(guess, epsilon, clue_strings[clue])
+        return self._moves(states)
+
+    def _copy(self):
+        # Marking the read-only arrays as already copied makes deepcopy share
+        # them instead
+        shared = {
+            id(value): value
+            for value in getattr(self.strategy, "__dict__", {}).values()
+            if isinstance(value, np.ndarray) and not value.flags.writeable
+        }
+        return copy.deepcopy(self.strategy, shared)
+
+    def _moves(self, states):
+        guesses = np.array([valid_index.get(state[1], -1) for state in states])
+        epsilons = np.array([state[2] for state in states], dtype=np.float64)
+        return states, guesses, epsilons
+
+    def __str__(self):
+        return str(self.strategy)
+
+if __name__ == "__main__":
+    # Checks that SingleGameAdapter plays a real strategy like the single-game
+    # protocol, with copies sharing its tables: python engine.py
+    import evaluate
+    import registry
+    strategy = registry.load("G3(epsilon1=9.3, epsilon2=5.3)")
+    adapter = SingleGameAdapter(strategy)
+    states, _, _ = adapter.first_moves(2)
+    assert all(state[0].cwa is strategy.cwa for state in states)
+    trial_seeds = np.random.SeedSequence(0).generate_state(300)
+    batched = evaluate.play_batch(adapter, trial_seeds)
+    single = [evaluate.play_trial(strategy, seed) for seed in trial_seeds]
+    assert [result.score for result in batched] == [result.score for result in single]
+    print(f"SingleGameAdapter played {len(trial_seeds)} games of {strategy} correctly")
@@ -1,26 +1,103 @@
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from datetime import datetime
+import itertools
+import json
 import math
+import os
 from pathlib import Path
 import random
-import signal
 import sys
+import time
+from typing import Optional
 
 import numpy as np
-from tqdm import trange
+from tqdm import tqdm
 
-# Add your new class here
-from strategies.g3 import G3
-from strategies.d95 import D95
+import engine
+from game_log import GameLog, read_game_log, repair
+import profiler
+import registry
+import result_cache
+import watchdog
+from watchdog import GameTimeout, Stopwatch
+from stats import (
+    LatencyHistogram, QuantileSketch, interval_width, paired_quantile_difference,
+    quantile_interval, stratified_quantile_interval, weighted_quantile,
+    weighted_quantile_interval)
 
-# Instantiate it at most 3 times with different parameters here
+# Add your new class to `registry.STRATEGIES`, and test it at most 3 times with
+# different parameters here. Strategies are built when they are evaluated, so
+# only the modules of the strategies under test are imported. Specs can also be
+# passed on the command line, e.g. `python evaluate.py "D95(epsilon=12.3)"`.
 STRATEGIES_UNDER_TEST = [
-    G3(epsilon1=9.3, epsilon2=5.3), # Current best for 5th percentile
-    D95(epsilon=12.3),
-    D95(epsilon=25.0),
+    "G3(epsilon1=9.3, epsilon2=5.3)", # Current best for 5th percentile
+    "D95(epsilon=12.3)",
+    "D95(epsilon=25.0)",
 ]
 
 NUM_TRIALS = 1001
+# If set, each strategy is instead evaluated by playing every answer this many
+# times (see `evaluate_stratified`); PRECISION, REFERENCE_SCORES, RESULT_CACHE
+# and CHECKPOINTS must then be None, and KEEP_SCORES True
+TRIALS_PER_ANSWER = None
 TIMEOUT_DURATION = 10
+# Time (in seconds) allowed for the untimed game played before an evaluation,
+# which includes compiling the strategy's numba functions (see `warm_up`)
+WARM_UP_DURATION = 60
+# Number of games played at once by strategies implementing the batched protocol
+BATCH_SIZE = 1000
+# Whether strategies implementing the batched protocol use it (see `play_batch`).
+# This is much faster, but the time of each batched call is split evenly between
+# its games, so the time limit only applies to the average game, and all games
+# get the same move latencies. Leaderboard runs keep this False, so that every
+# game is played and timed on its own.
+BATCHED = False
+# Number of processes used to play games in parallel
+NUM_WORKERS = 1
+# If set, the evaluation stops as soon as the confidence intervals of all
+# reported quantiles are narrower than this (see `evaluate`)
+PRECISION = None
+# If set, a dictionary mapping quantiles to scores; the evaluation stops as soon
+# as the strategy is clearly worse than all of them (see `evaluate`)
+REFERENCE_SCORES = None
+# Number of games between two checks of these stopping rules
+CHECK_INTERVAL = 100
+# Whether to also write the results of every game to a game log (see
+# game_log.py) in the results directory
+LOG_GAMES = True
+# Seed shared by all strategies under test (chosen at random if None), so they
+# play the same secret words with the same noise, and their scores can be
+# compared in pairs (see `compare`)
+SEED = 0
+# If set, directory where the results of evaluations are cached, so that
+# strategies that have not changed are not evaluated again (see `evaluate`)
+RESULT_CACHE = "results/cache"
+# Whether to profile the moves of the strategies, writing a flamegraph-compatible
+# profile per strategy in the results directory (see `evaluate`)
+PROFILE = False
+# If set, strategies are instead evaluated with importance sampling, flipping
+# this many times more clues than the game (see `evaluate_tilted`); the same
+# settings as with TRIALS_PER_ANSWER must then be unset
+TILT = None
+# If set, each evaluation is checkpointed to a file in this directory, and
+# resumed from it if it already exists (see `evaluate`)
+CHECKPOINTS = None
+# Time (in seconds) between two checkpoints of the results of an evaluation, and
+# between two flushes of its game log
+CHECKPOINT_INTERVAL = 60
+# Whether to keep the score of every game in memory; if False, the scores are
+# summarized in a QuantileSketch, which uses constant memory, but cannot be
+# compared in pairs
+KEEP_SCORES = True
+
+# Worker processes are forked, possibly after numba started the threads of its
+# parallel functions in this process (e.g. after an evaluation with workers=0).
+# Numba's default threading layer on Linux, TBB, then hangs when the process
+# exits, so the fork-safe workqueue layer is used unless another one was chosen.
+# This must be set before numba is imported, which only happens when it is used.
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
 
 with open("valid.txt", "r") as f:
     valid = set(f.read().splitlines())
@@ -28,12 +105,59 @@ with open("valid.txt", "r") as f:
 with open("answers.txt", "r") as f:
     answers = f.read().splitlines()
 
-timeout = Exception("timeout!")
+class MoveLatencies:
+    """Records the wall time of the strategy's moves during an evaluation, in
+    one LatencyHistogram per move number.
+
+    Games played in batches (see `play_batch`) only know their share of the
+    time of each batched call, so all the games of a call get the same
+    latency, and slow games are hidden. Evaluate with `batched=False` to
+    record the latency of each game."""
+
+    def __init__(self):
+        self.histograms = []
+
+    def record(self, result):
+        for move, wall_time in enumerate(result.wall_times):
+            if move == len(self.histograms):
+                self.histograms.append(LatencyHistogram())
+            self.histograms[move].record(wall_time)
+
+    def summary(self):
+        """Returns a list with a `(p50, p99, max)` tuple for each move number."""
+        return [
+            (histogram.percentile(0.5), histogram.percentile(0.99), histogram.max)
+            for histogram in self.histograms
+        ]
+
+@dataclass
+class GameResult:
+    """The outcome of a game played during an evaluation."""
+    score: float
+    # Wall and CPU time (in seconds) spent by the strategy on each move
+    wall_times: list = field(default_factory=list)
+    cpu_times: list = field(default_factory=list)
+    # Number of the move (starting at 0) during which the game timed out, if it did
+    timeout_move: Optional[int] = None
+    # Index of the secret word in `answers.txt`
+    secret: int = -1
+    # Indices in `valid.txt` of the guesses made by the strategy (-1 for words
+    # that are not in `valid.txt`), with their epsilons, and the clue codes
+    # received for each guess but the final one
+    guesses: list = field(default_factory=list)
+    epsilons: list = field(default_factory=list)
+    clues: list = field(default_factory=list)
+    # Likelihood ratio of the noise of the game, when it is played with a
+    # tilted noise distribution (see `evaluate_tilted`)
+    weight: float = 1.
 
-def raise_timeout(signum, frame):
-    raise timeout
+    @property
+    def timed_out(self):
+        return self.timeout_move is not None
 
-def evaluate(strategy, num_trials, debug=False):
+def evaluate(strategy, num_trials, debug=False, workers=1, seed=None,
+             precision=None, reference=None, log=None, latencies=None, cache=None,
+             keep_scores=True, profile=None, checkpoint=None, batched=True):
     """Evaluates a strategy over multiple trials.
 
     `strategy` must be an object of a class implementing two methods:
@@ -55,42 +179,698 @@ def evaluate(strategy, num_trials, debug=False):
     list. Epsilon values must be nonnegative; an epsilon value of 0 represents the
     player's final guess.
 
-    Returns a tuple with five elements: the list of scores, the 5th, 50th,
-    and 95th percentiles of the scores, and the number of timeouts.
+    The games are played in `workers` processes. The workers are forked from
+    the current process, so any state built by the strategy before the call
+    (e.g. precomputed tables) is shared with them rather than rebuilt. Each
+    trial is seeded with a value derived from `seed`, so for a given seed, the
+    results do not depend on the number of workers.
+
+    Each game must terminate within `TIMEOUT_DURATION` seconds, counting the
+    time spent in the strategy's moves; otherwise, it is lost. This is checked
+    after each move, and workers still busy after this delay (plus a grace
+    period) are killed. If `workers` is 0, the games are played in the current
+    process, where moves that never return cannot be interrupted.
+
+    Strategies can also implement a batched version of these methods, which
+    plays many games at once; see `play_batch`. It is used instead of
+    `first_move` and `next_move` when available, unless `batched` is False.
+    Batched games are only timed on average, so use `batched=False` to apply
+    the time limit to every game.
+
+    The evaluation can stop before `num_trials` games are played, in two cases.
+    - If `precision` is set, and the confidence intervals of the 5th, 50th,
+      and 95th percentiles (see `stats.quantile_interval`) are all narrower
+      than `precision`.
+    - If `reference` is set to a dictionary mapping quantiles to scores, and
+      the lower bound of the confidence interval of each of these quantiles is
+      larger than its reference score: the strategy is then clearly worse.
+    These rules are checked every `CHECK_INTERVAL` games. Since each check
+    could wrongly stop the evaluation, their intervals have a 5% error rate
+    split evenly between the checks (a Bonferroni correction): the confidence
+    level of each is 1 - 0.05 / ceil(num_trials / CHECK_INTERVAL).
+
+    If `log` is set, the results of all games are appended to the game log at
+    this path; see `game_log.py`. The log is written in chunks, and flushed
+    every `CHECKPOINT_INTERVAL` seconds, so a crash loses at most the games of
+    the last interval. If `latencies` is a MoveLatencies object, the time of
+    every move is recorded in it.
+
+    If `cache` is set to a directory and `seed` is set, the results of the
+    games are cached in this directory, and games whose results are already in
+    the cache are not played again; see `result_cache.py`.
+
+    If `profile` is set, the moves of the strategy are profiled with a sampling
+    profiler in every worker process, and the merged samples are written to
+    this path in the folded format of flamegraph tools; see `profiler.py`.
+    Games whose results are cached are not profiled.
+
+    If `checkpoint` is set, the evaluation is checkpointed to this path every
+    `CHECKPOINT_INTERVAL` seconds, and when it is interrupted (e.g. with
+    Ctrl-C). If the checkpoint already exists, the evaluation resumes from it:
+    it uses the seed stored in the checkpoint (chosen at random when it was
+    created, if `seed` is None), reads the results of the games already
+    played, and only plays the next ones. Since each trial only depends on the
+    seed and its index, the results are the same as those of an uninterrupted
+    evaluation. Checkpoints are game logs, with the strategy and seed in a
+    JSON file next to them; they take precedence over the cache.
+
+    If `keep_scores` is False, the scores are added to a QuantileSketch instead
+    of a list, so that memory use does not grow with the number of games; the
+    quantiles are then estimated with a small relative error.
+
+    Returns a tuple with five elements: the list of scores (or their
+    QuantileSketch), the 5th, 50th, and 95th percentiles of the scores, and the
+    number of timeouts.
     """
-    scores = []
-    timeouts = 0
-    for _ in trange(num_trials, smoothing=0):
-        try:
-            signal.signal(signal.SIGALRM, raise_timeout)
-            signal.alarm(TIMEOUT_DURATION)
-            scores.append(evaluate_once(strategy, debug))
-        except Exception as e:
-            if e == timeout:
-                timeouts += 1
+    # Game log where the results are stored, for the cache or the checkpoint
+    store_path = None
+    stored = []
+    if checkpoint:
+        seed = checkpoint_seed(checkpoint, strategy, seed)
+        store_path = checkpoint
+    elif cache:
+        store_path = result_cache.cache_path(
+            cache, strategy, seed, TIMEOUT_DURATION, group_size(strategy, batched))
+    if store_path:
+        stored = read_stored_results(store_path)
+        if len(stored) >= num_trials:
+            # All the results are already stored, so none will be added
+            stored = stored[:num_trials]
+            store_path = None
+    trial_seeds = np.random.SeedSequence(seed).generate_state(num_trials)
+    scores = [] if keep_scores else QuantileSketch()
+    num_scores = 0
+    timeouts_by_move = Counter()
+    samples = Counter() if profile else None
+    results = itertools.chain(
+        stored,
+        play_trials(strategy, trial_seeds[len(stored):], workers, debug, samples=samples,
+                    batched=batched),
+    )
+    # Results are stored by whole groups of games (see `play_trials`), so that
+    # the games played after resuming are grouped like the others
+    group = group_size(strategy, batched)
+    pending = []
+    last_flush = time.monotonic()
+    confidence = 1 - 0.05 / math.ceil(num_trials / CHECK_INTERVAL)
+    with (
+        GameLog(log) if log else nullcontext() as game_log,
+        GameLog(store_path, math.inf) if store_path else nullcontext() as store_log,
+    ):
+        for i, result in enumerate(tqdm(results, total=num_trials, smoothing=0)):
+            if keep_scores:
+                scores.append(result.score)
             else:
-                print(f"Encountered exception {e}")
-            scores.append(float('inf'))
+                scores.add(result.score)
+            num_scores += 1
+            if store_log and i >= len(stored):
+                pending.append(result)
+                if (i + 1) % group == 0 or i + 1 == num_trials:
+                    for stored_result in pending:
+                        store_log.write(stored_result)
+                    pending.clear()
+            if result.timed_out:
+                timeouts_by_move[result.timeout_move] += 1
+            if game_log:
+                game_log.write(result)
+            # The store only holds whole groups, so it can be flushed at any time
+            last_flush = flush_periodically([game_log, store_log], last_flush)
+            if latencies:
+                latencies.record(result)
+            if num_scores % CHECK_INTERVAL == 0 and num_scores < num_trials:
+                if should_stop(scores, precision, reference, confidence):
+                    print(f"Stopping early after {num_scores} trials")
+                    break
+    if profile:
+        profiler.write_folded(samples, profile)
+    timeouts = report_timeouts(timeouts_by_move)
+    return (
+        scores,
+        quantile(scores, 0.05),
+        quantile(scores, 0.5),
+        quantile(scores, 0.95),
+        timeouts,
+    )
+
+def flush_periodically(logs, last_flush):
+    """Flushes the game logs (None values being ignored) if they were last
+    flushed at `last_flush` (a `time.monotonic` value), more than
+    `CHECKPOINT_INTERVAL` seconds ago. Returns the time of the last flush."""
+    if time.monotonic() - last_flush <= CHECKPOINT_INTERVAL:
+        return last_flush
+    for game_log in logs:
+        if game_log:
+            game_log.flush()
+    return time.monotonic()
+
+def checkpoint_seed(path, strategy, seed):
+    """Returns the seed of the evaluation checkpointed at `path`, after checking
+    that it evaluated `strategy`. If the checkpoint does not exist yet, creates
+    it with `seed`, or with a random seed if `seed` is None."""
+    metadata_path = Path(f"{path}.json")
+    if metadata_path.exists():
+        metadata = json.loads(metadata_path.read_text())
+        if metadata["strategy"] != str(strategy):
+            raise ValueError(
+                f"checkpoint {path} is for strategy {metadata['strategy']}, not {strategy}")
+        if seed is not None and seed != metadata["seed"]:
+            raise ValueError(
+                f"checkpoint {path} uses seed {metadata['seed']}, not {seed}")
+        print(f"Resuming the evaluation checkpointed at {path}")
+        return metadata["seed"]
+    if seed is None:
+        seed = random.randrange(2**32)
+    metadata_path.write_text(json.dumps({"strategy": str(strategy), "seed": seed}))
+    return seed
+
+def read_stored_results(path):
+    """Reads the GameResults stored in a game log by the result cache or a
+    checkpoint, or returns an empty list if it is missing. An incomplete chunk
+    at the end of the log is discarded.
+
+    Missing values are stored as padding in game logs, so the lists of moves of
+    the results are cut at the first missing value of each column.
+    """
+    if not Path(path).exists():
+        return []
+    repair(path)
+    games, moves = read_game_log(path)
+    offsets = np.concatenate([[0], np.cumsum(games["num_moves"], dtype=np.int64)])
+    results = []
+    for i in range(len(games["score"])):
+        start, end = offsets[i], offsets[i + 1]
+        epsilons = moves["epsilon"][start:end]
+        clues = moves["clue"][start:end]
+        wall_times = moves["wall_time"][start:end]
+        cpu_times = moves["cpu_time"][start:end]
+        timeout_move = int(games["timeout_move"][i])
+        results.append(GameResult(
+            score=float(games["score"][i]),
+            wall_times=wall_times[:_present(~np.isnan(wall_times))].tolist(),
+            cpu_times=cpu_times[:_present(~np.isnan(cpu_times))].tolist(),
+            timeout_move=None if timeout_move == -1 else timeout_move,
+            secret=int(games["secret"][i]),
+            guesses=moves["guess"][start:end][:_present(~np.isnan(epsilons))].tolist(),
+            epsilons=epsilons[:_present(~np.isnan(epsilons))].tolist(),
+            clues=clues[:_present(clues != 255)].tolist(),
+        ))
+    return results
+
+def _present(mask):
+    """Returns the length of the leading run of True values of `mask`."""
+    return len(mask) if mask.all() else int(np.argmin(mask))
+
+def compare(scores, baseline):
+    """Compares the scores of a strategy to the scores of a baseline strategy
+    evaluated with the same seed.
+
+    With the same seed, the i-th trial of both evaluations is played with the
+    same secret word and the same noise draws, as far as the guesses of both
+    strategies allow (see `trial_generator`). The differences of their
+    quantiles are then much less noisy than with independent evaluations. If
+    an evaluation stopped early, only the trials played by both are compared.
+
+    Returns a dictionary mapping the 5th, 50th, and 95th percentiles to a
+    `(difference, low, high)` tuple, where `low` and `high` are the bounds of a
+    95% confidence interval for the difference; see
+    `stats.paired_quantile_difference`.
+    """
+    n = min(len(scores), len(baseline))
+    return {
+        q: paired_quantile_difference(scores[:n], baseline[:n], q)
+        for q in (0.05, 0.5, 0.95)
+    }
+
+def report_timeouts(timeouts_by_move):
+    """Prints the number of timeouts of an evaluation, given the number of
+    timeouts during each move, and returns it."""
+    timeouts = sum(timeouts_by_move.values())
     if timeouts > 0:
-        print(f"Evaluation timed out {timeouts} times")
+        by_move = ", ".join(
+            f"move {move}: {count}" for move, count in sorted(timeouts_by_move.items()))
+        print(f"Evaluation timed out {timeouts} times ({by_move})")
+    return timeouts
+
+def should_stop(scores, precision=None, reference=None, confidence=0.95):
+    """Checks the early stopping rules of `evaluate`, with confidence intervals
+    at the `confidence` level."""
+    if precision is not None:
+        widths = [
+            interval_width(*quantile_interval(scores, q, confidence))
+            for q in (0.05, 0.5, 0.95)
+        ]
+        if max(widths) <= precision:
+            return True
+    if reference:
+        return all(
+            quantile_interval(scores, q, confidence)[0] > score
+            for q, score in reference.items()
+        )
+    return False
+
+def evaluate_stratified(strategy, trials_per_answer, workers=1, seed=None, log=None,
+                        latencies=None, batched=True, profile=None):
+    """Evaluates a strategy by playing each word of `answers.txt` as the secret
+    word `trials_per_answer` times.
+
+    Compared to `evaluate`, this removes the variance coming from the random
+    choice of the secret words, so fewer games are needed to reach a given
+    precision. All answers being equally likely, the games are equally weighted
+    when estimating the quantiles.
+
+    Returns a tuple with six elements: the list of scores (grouped by answer), the
+    5th, 50th, and 95th percentiles of the scores, the number of timeouts, and a
+    dictionary mapping each of these quantiles to a `(variance, low, high)`
+    tuple. `variance` is the estimated variance of the score CDF at the quantile,
+    and `low` and `high` are the bounds of a 95% confidence interval for the
+    quantile; see `stats.stratified_quantile_interval`.
+
+    `log`, `latencies`, `batched` and `profile` are used like in `evaluate`.
+    """
+    num_trials = len(answers) * trials_per_answer
+    trial_seeds = np.random.SeedSequence(seed).generate_state(num_trials)
+    secrets = np.repeat(np.arange(len(answers)), trials_per_answer)
+    scores = []
+    timeouts_by_move = Counter()
+    samples = Counter() if profile else None
+    results = play_trials(strategy, trial_seeds, workers, secrets=secrets, batched=batched,
+                          samples=samples)
+    last_flush = time.monotonic()
+    with GameLog(log) if log else nullcontext() as game_log:
+        for result in tqdm(results, total=num_trials, smoothing=0):
+            scores.append(result.score)
+            if result.timed_out:
+                timeouts_by_move[result.timeout_move] += 1
+            if game_log:
+                game_log.write(result)
+                last_flush = flush_periodically([game_log], last_flush)
+            if latencies:
+                latencies.record(result)
+    if profile:
+        profiler.write_folded(samples, profile)
+    timeouts = report_timeouts(timeouts_by_move)
+    by_answer = np.reshape(scores, (len(answers), trials_per_answer))
+    intervals = {
+        q: stratified_quantile_interval(by_answer, q)
+        for q in (0.05, 0.5, 0.95)
+    }
     return (
         scores,
         quantile(scores, 0.05),
         quantile(scores, 0.5),
         quantile(scores, 0.95),
         timeouts,
+        intervals,
     )
 
+def evaluate_tilted(strategy, num_trials, tilt, workers=1, seed=None, log=None,
+                    latencies=None, batched=True, profile=None):
+    """Evaluates a strategy using importance sampling, to estimate the tails of
+    its score distribution with fewer games than `evaluate`.
+
+    The games are played with a tilted noise distribution: the probability of
+    randomizing each letter of the clues is multiplied by `tilt` (see
+    `engine.randomization_probabilities`). The strategy is not told about it.
+    Flipping fewer clues (`tilt` < 1) makes games with low scores more frequent,
+    which helps estimating the 5th percentile; flipping more clues (`tilt` > 1)
+    helps for the 95th percentile. Each game is then weighted by the
+    likelihood ratio of its noise between the game's distribution and the
+    tilted one, which only depends on the number of letters that differ
+    between the real and noisy clues of each move.
+
+    Returns a tuple with seven elements: the list of scores, the list of their
+    weights, the weighted 5th, 50th, and 95th percentiles of the scores, the
+    number of timeouts, and a dictionary mapping each of these quantiles to a
+    `(variance, low, high)` tuple, like in `evaluate_stratified`; see
+    `stats.weighted_quantile_interval`.
+
+    `workers`, `seed`, `log`, `latencies`, `batched` and `profile` are used like
+    in `evaluate`.
+    """
+    trial_seeds = np.random.SeedSequence(seed).generate_state(num_trials)
+    scores = []
+    weights = []
+    timeouts_by_move = Counter()
+    samples = Counter() if profile else None
+    results = play_trials(strategy, trial_seeds, workers, tilt=tilt, batched=batched,
+                          samples=samples)
+    last_flush = time.monotonic()
+    with GameLog(log) if log else nullcontext() as game_log:
+        for result in tqdm(results, total=num_trials, smoothing=0):
+            scores.append(result.score)
+            weights.append(result.weight)
+            if result.timed_out:
+                timeouts_by_move[result.timeout_move] += 1
+            if game_log:
+                game_log.write(result)
+                last_flush = flush_periodically([game_log], last_flush)
+            if latencies:
+                latencies.record(result)
+    if profile:
+        profiler.write_folded(samples, profile)
+    timeouts = report_timeouts(timeouts_by_move)
+    intervals = {
+        q: weighted_quantile_interval(scores, weights, q)
+        for q in (0.05, 0.5, 0.95)
+    }
+    return (
+        scores,
+        weights,
+        weighted_quantile(scores, weights, 0.05),
+        weighted_quantile(scores, weights, 0.5),
+        weighted_quantile(scores, weights, 0.95),
+        timeouts,
+        intervals,
+    )
+
+def play_trials(strategy, trial_seeds, workers=1, debug=False, secrets=None,
+                tilt=1., samples=None, batched=True):
+    """Plays one game per trial seed in `workers` processes (or in the current
+    process if `workers` is 0), and yields their GameResult in the same order
+    as the seeds.
+
+    If `secrets` is set, it is an array of indices in `answers.txt` with one
+    secret word per trial seed; otherwise, the secret word of each game is
+    chosen at random. If `tilt` is set, the noise is tilted like in
+    `evaluate_tilted`. If `samples` is set, the moves are profiled, and the
+    samples of all workers are added to this Counter (see `profiler.py`).
+
+    Strategies implementing the batched protocol (see `play_batch`) play
+    `BATCH_SIZE` games at a time, unless `batched` is False; the others play
+    one game at a time.
+
+    Before the first game, the strategy plays an untimed game (see `warm_up`)
+    in the current process, so that the workers forked afterwards inherit its
+    compiled functions. If this game does not finish in time, every game is
+    lost. Each worker uses its share of numba's threads."""
+    group = group_size(strategy, batched)
+    # Generated lazily, since a list of tasks would grow with the number of games
+    tasks = (
+        (
+            trial_seeds[i:i + group],
+            None if secrets is None else secrets[i:i + group],
+        )
+        for i in range(0, len(trial_seeds), group)
+    )
+    def run(task):
+        play = lambda: play_task(strategy, *task, debug=debug, tilt=tilt, batched=batched)
+        return play() if samples is None else profiler.profile_call(play)
+
+    def failed_result(task, move, timed_out):
+        results = failed_task_results(task, move, timed_out)
+        return results if samples is None else (results, Counter())
+
+    initializer = None
+    if workers >= 1:
+        import numba
+
+        # Compute the clue table before forking the workers, so that they share
+        # it instead of each computing their own copy
+        engine.clue_table()
+        check_fork_safety()
+        threads = max(1, numba.config.NUMBA_NUM_THREADS // workers)
+        initializer = lambda: numba.set_num_threads(threads)
+    failure = None
+    if len(trial_seeds) > 0:
+        failure = warm_up(strategy, batched, workers, initializer)
+    if failure is not None:
+        move, timed_out = failure
+        print(f"The warm-up game {'timed out' if timed_out else 'failed'} "
+              f"during move {move}, so every game is lost")
+        results = (failed_result(task, move, timed_out) for task in tasks)
+    elif workers < 1:
+        results = map(run, tasks)
+    else:
+        results = watchdog.run_tasks(
+            run,
+            tasks,
+            math.ceil(len(trial_seeds) / group),
+            lambda task: TIMEOUT_DURATION * len(task[0]),
+            workers,
+            failed_result,
+            initializer=initializer,
+        )
+    for task_results in results:
+        if samples is not None:
+            task_results, task_samples = task_results
+            samples.update(task_samples)
+        yield from task_results
+
+def warm_up(strategy, batched=True, workers=1, initializer=None):
+    """Plays a game whose result is discarded, so that the time spent compiling
+    the strategy's numba functions, or filling its caches, is not counted
+    against the first game played by each worker process. Otherwise, this
+    time would depend on the number of workers, and replacements of killed
+    workers would compile them again and time out again.
+
+    The game is played in the current process, where a move that never returns
+    cannot be interrupted. So if `workers` is at least 1, it is first played in
+    a throwaway worker process (set up by `initializer`), which is killed after
+    `WARM_UP_DURATION` seconds. Returns None if the game finished, or the
+    `(move, timed_out)` pair describing how this worker failed."""
+    trial_seeds = np.zeros(1, dtype=np.uint32)
+    def play(trial_seeds):
+        play_task(strategy, trial_seeds, batched=batched)
+
+    if workers >= 1:
+        failure = next(watchdog.run_tasks(
+            play,
+            [trial_seeds],
+            1,
+            lambda task: WARM_UP_DURATION,
+            1,
+            lambda task, move, timed_out: (move, timed_out),
+            initializer=initializer,
+        ))
+        if failure is not None:
+            return failure
+    play(trial_seeds)
+    return None
+
+def check_fork_safety():
+    """Warns when numba's parallel threads were started in the current process
+    with a threading layer that does not support forking worker processes."""
+    import numba
+
+    try:
+        layer = numba.threading_layer()
+    except ValueError:
+        # The threads were not started
+        return
+    if layer != "workqueue":
+        print(f"Warning: forking worker processes after numba started its {layer} "
+              "threads may hang; set NUMBA_THREADING_LAYER=workqueue")
+
+def group_size(strategy, batched=True):
+    """Returns the number of games played at once by `strategy`."""
+    return BATCH_SIZE if batched and is_batched(strategy) else 1
+
+def failed_task_results(task, move, timed_out):
+    """Returns the results of the games of a task whose worker process was
+    killed or died during move number `move`."""
+    trial_seeds, _ = task
+    return [
+        GameResult(float('inf'), timeout_move=move if timed_out else None)
+        for _ in trial_seeds
+    ]
+
+def play_task(strategy, trial_seeds, secrets=None, debug=False, tilt=1., batched=True):
+    """Plays the games of a group of trial seeds, and returns the list of
+    their GameResult."""
+    if batched and is_batched(strategy):
+        return play_batch(strategy, trial_seeds, secrets, tilt)
+    if secrets is None:
+        secrets = [None] * len(trial_seeds)
+    return [
+        play_trial(strategy, trial_seed, debug, secret, tilt)
+        for trial_seed, secret in zip(trial_seeds, secrets)
+    ]
+
+def trial_generator(trial_seed):
+    """Returns the random generator used by the game for a trial.
+
+    The game first draws the secret word from it, then, for each move, a
+    (2, 5) array of uniform numbers deciding the noise of each letter (see
+    `engine.noisy_clue_codes`). This generator is separate from the ones used
+    by the strategy, so strategies evaluated with the same trial seeds are
+    given the same secret words and noise draws: they are compared using
+    common random numbers, as far as their guesses allow.
+    """
+    return np.random.default_rng(int(trial_seed))
+
+def play_trial(strategy, trial_seed, debug=False, secret=None, tilt=1.):
+    """Plays a single game with all sources of randomness seeded by
+    `trial_seed`. If `secret` is set, it is the index of the secret word in
+    `answers.txt`. If `tilt` is set, the noise is tilted like in
+    `evaluate_tilted`. Returns its GameResult."""
+    trial_seed = int(trial_seed)
+    random.seed(trial_seed)
+    np.random.seed(trial_seed)
+    noise = trial_generator(trial_seed)
+    random_secret = noise.integers(len(answers))
+    answer = answers[random_secret if secret is None else secret]
+    stopwatch = Stopwatch(TIMEOUT_DURATION)
+    transcript = []
+    result = GameResult(
+        float('inf'), stopwatch.wall_times, stopwatch.cpu_times,
+        secret=engine.answer_index[answer],
+    )
+    try:
+        result.score = evaluate_once(
+            strategy, debug, answer=answer, stopwatch=stopwatch,
+            transcript=transcript, noise=noise, tilt=tilt)
+    except GameTimeout as e:
+        result.timeout_move = e.move
+    except Exception as e:
+        print(f"Encountered exception {e}")
+    for guess, epsilon, clues in transcript:
+        result.guesses.append(engine.valid_index.get(guess, -1))
+        result.epsilons.append(epsilon)
+        if clues is not None:
+            result.clues.append(engine.clue_code(clues))
+    if tilt != 1:
+        moves = len(result.clues)
+        real_clues = engine.clue_table()[result.guesses[:moves], result.secret]
+        result.weight = np.prod(engine.likelihood_ratios(
+            real_clues, result.clues, result.epsilons[:moves], tilt)).item()
+    return result
+
+def is_batched(strategy):
+    """Whether `strategy` implements the batched protocol."""
+    return hasattr(strategy, "first_moves") and hasattr(strategy, "next_moves")
+
+def play_batch(strategy, trial_seeds, secrets=None, tilt=1.):
+    """Plays one game per trial seed with a strategy implementing the batched
+    protocol, which consists of two methods:
+    - `first_moves(n)` returns a `(states, guesses, epsilons)` tuple for the
+      first move of `n` games.
+    - `next_moves(states, clues)` returns the same kind of tuple for the next
+      move of each game, given the states returned by the previous call and the
+      noisy clues of the previous moves.
+    `guesses` is an array of indices in `valid.txt`, `epsilons` an array of
+    epsilon values, and `clues` an array of clue codes as defined in `engine.py`.
+    `states` is an opaque array whose first axis indexes the games. Games that
+    already made their final guess are still part of the batch passed to
+    `next_moves`; their clues are meaningless and their moves are ignored.
+
+    All the randomness of the batch is seeded by the trial seeds, and the
+    secret words and noise of each game are the same as when playing it with
+    `play_trial`. If `secrets` is set, it is the array of the indices of the
+    secret words in `answers.txt`; otherwise, they are chosen at random. If
+    `tilt` is set, the noise is tilted like in `evaluate_tilted`.
+
+    The time of each call to `first_moves` or `next_moves` is split evenly
+    between the games still being played, and games whose total time exceeds
+    `TIMEOUT_DURATION` are lost. So the time limit only applies to the average
+    game of a batch: a slow game is hidden by fast ones, and work shared by the
+    games (e.g. memoized moves) is amortized over them. To time each game on
+    its own, evaluate with `batched=False`.
+
+    Returns the list of GameResult of the games.
+    """
+    n = len(trial_seeds)
+    random.seed(int(trial_seeds[0]))
+    np.random.seed(int(trial_seeds[0]))
+    noises = [trial_generator(trial_seed) for trial_seed in trial_seeds]
+    random_secrets = np.array([noise.integers(len(answers)) for noise in noises])
+    secrets = random_secrets if secrets is None else np.asarray(secrets)
+    totals = np.zeros(n)
+    weights = np.ones(n)
+    final_guesses = np.full(n, -1)
+    timeout_moves = np.full(n, -1)
+    playing = np.ones(n, dtype=bool)
+    # Time spent by the strategy on each game, and for each move, the time per
+    # game (NaN for the games that were over), the moves, and the clues (255
+    # for the games that did not get any)
+    elapsed = np.zeros(n)
+    wall_times = []
+    cpu_times = []
+    move_guesses = []
+    move_epsilons = []
+    move_clues = []
+    try:
+        for move in itertools.count():
+            watchdog.set_current_move(move)
+            wall, cpu = time.perf_counter(), time.process_time()
+            with profiler.sampling():
+                if move == 0:
+                    states, guesses, epsilons = strategy.first_moves(n)
+                else:
+                    states, guesses, epsilons = strategy.next_moves(states, clues)
+            players = np.count_nonzero(playing)
+            wall_times.append(
+                np.where(playing, (time.perf_counter() - wall) / players, np.nan))
+            cpu_times.append(
+                np.where(playing, (time.process_time() - cpu) / players, np.nan))
+            elapsed[playing] += wall_times[-1][playing]
+            timing_out = playing & (elapsed > TIMEOUT_DURATION)
+            timeout_moves[timing_out] = move
+            playing &= ~timing_out
+
+            guesses = np.asarray(guesses)
+            epsilons = np.asarray(epsilons, dtype=np.float64)
+            move_guesses.append(guesses)
+            move_epsilons.append(epsilons)
+            move_clues.append(np.full(n, 255, dtype=np.uint8))
+            # Invalid guesses lose the game
+            playing &= (guesses >= 0) & (guesses < len(engine.valid_words))
+            finishing = playing & (epsilons <= 0)
+            final_guesses[finishing] = guesses[finishing]
+            playing &= ~finishing
+            if not playing.any():
+                break
+            totals[playing] += epsilons[playing]
+            clues = move_clues[-1]
+            draws = np.stack(
+                [noises[i].random((2, 5)) for i in np.flatnonzero(playing)], axis=1)
+            clues[playing] = engine.noisy_clue_codes(
+                secrets[playing], guesses[playing], epsilons[playing], draws=draws,
+                tilt=tilt)
+            if tilt != 1:
+                real_clues = engine.clue_table()[guesses[playing], secrets[playing]]
+                weights[playing] *= engine.likelihood_ratios(
+                    real_clues, clues[playing], epsilons[playing], tilt)
+    except Exception as e:
+        print(f"Encountered exception {e}")
+        return [GameResult(float('inf')) for _ in range(n)]
+    won = final_guesses == engine.answer_guesses[secrets]
+    scores = np.where(won, totals, float('inf'))
+    wall_times = np.column_stack(wall_times)
+    cpu_times = np.column_stack(cpu_times)
+    move_guesses = np.column_stack(move_guesses)
+    move_epsilons = np.column_stack(move_epsilons)
+    move_clues = np.column_stack(move_clues)
+    results = []
+    for i in range(n):
+        played = ~np.isnan(wall_times[i])
+        guesses = move_guesses[i, played]
+        results.append(GameResult(
+            scores[i].item(),
+            wall_times[i, played].tolist(),
+            cpu_times[i, played].tolist(),
+            timeout_moves[i].item() if timeout_moves[i] >= 0 else None,
+            secret=secrets[i].item(),
+            guesses=np.where(guesses < len(engine.valid_words), guesses, -1).tolist(),
+            epsilons=move_epsilons[i, played].tolist(),
+            clues=move_clues[i, move_clues[i] != 255].tolist(),
+            weight=weights[i].item(),
+        ))
+    return results
+
 def quantile(a, q):
+    if isinstance(a, QuantileSketch):
+        return a.quantile(q)
     # numpy's quantile gets confused when there are infinity values. So we
     # convert all of them to a very large float, and then convert back very
     # large values to infinity.
-    r = np.quantile([sys.float_info.max if math.isinf(x) else x for x in a], q)
+    a = np.asarray(a, dtype=np.float64)
+    r = np.quantile(np.where(np.isinf(a), sys.float_info.max, a), q)
     if r > sys.float_info.max/100:
         return float('inf')
     return r
 
-def evaluate_once(strategy, debug=False, end_message=False):
+def evaluate_once(strategy, debug=False, end_message=False, answer=None,
+                  stopwatch=None, transcript=None, noise=None, tilt=1.):
     """Evaluates a strategy once.
 
     Returns float('inf') if the final guess of the strategy is wrong; otherwise,
@@ -101,12 +881,30 @@ def evaluate_once(strategy, debug=False, end_message=False):
 
     If end_message is true, prints the answer at the end of the game indicating
     whether the player won or lost.
+
+    The secret word is `answer` if set, and is chosen at random otherwise.
+
+    If `stopwatch` is set, it is a `watchdog.Stopwatch` measuring the time of
+    each move, which raises GameTimeout if the game takes too long.
+
+    If `transcript` is set, a `(guess, epsilon, noisy_clues)` tuple is appended
+    to it for each move, `noisy_clues` being None for the final guess.
+
+    The noise is drawn from `noise`, a `numpy.random.Generator`, if set. If
+    `tilt` is set, the probability of randomizing each letter is multiplied by
+    it (see `evaluate_tilted`).
     """
-    answer = random.choice(answers)
+    if answer is None:
+        answer = random.choice(answers)
+    if stopwatch is None:
+        stopwatch = Stopwatch(math.inf)
+    if noise is None:
+        noise = np.random.default_rng()
 
     if debug:
         print(f"Real answer: '{answer}'")
-    guess, epsilon = strategy.first_move()
+    with stopwatch.move(), profiler.sampling():
+        guess, epsilon = strategy.first_move()
     total_epsilon = 0
 
     # Answer as many guesses as requested
@@ -114,29 +912,28 @@ def evaluate_once(strategy, debug=False, end_message=False):
         if guess not in valid:
             raise ValueError(f"guess '{guess}' is not in the valid.txt word list")
         total_epsilon += epsilon
-        real_clues = ''
-        for (i, letter) in enumerate(guess):
-            if letter == answer[i]:
-                real_clues += 'c'
-            elif letter in answer:
-                real_clues += 'i'
-            else:
-                real_clues += '.'
+        real_clues = engine.real_clues(guess, answer)
         noisy_clues = ''
-        for a in real_clues:
+        draws = noise.random((2, 5))
+        for (i, a) in enumerate(real_clues):
             # Choose randomly with probability 3/(2+e^(ε/5)); equivalent to choosing
             # randomly *among the incorrect options* with probability 2/(2+e^(ε/5)).
-            if random.random() < 3./(2.+math.exp(epsilon/5)):
-                noisy_clues += random.choice(['c', 'i', '.'])
+            if draws[0][i] < min(tilt * 3./(2.+math.exp(epsilon/5)), 1.):
+                noisy_clues += "ci."[int(draws[1][i] * 3)]
             else:
                 noisy_clues += a
         if debug:
             print(f"Guess '{guess}' with epsilon={epsilon}")
             print(f"  Real clues: '{real_clues}'")
             print(f"  Noisy clues: '{noisy_clues}'")
-        guess, epsilon = strategy.next_move(guess, epsilon, noisy_clues)
+        if transcript is not None:
+            transcript.append((guess, epsilon, noisy_clues))
+        with stopwatch.move(), profiler.sampling():
+            guess, epsilon = strategy.next_move(guess, epsilon, noisy_clues)
 
     # Check final answer
+    if transcript is not None:
+        transcript.append((guess, epsilon, None))
     if guess == answer:
         if debug or end_message:
             print(f"Final guess '{guess}' is correct! :D")
@@ -149,25 +946,88 @@ def evaluate_once(strategy, debug=False, end_message=False):
     return float('inf')
 
 if __name__ == "__main__":
-    time = datetime.now().strftime("%Y-%m-%d-%Hh%Mm%Ss")
+    if TRIALS_PER_ANSWER or TILT:
+        # These settings are only supported by `evaluate`
+        unsupported = {
+            "PRECISION": PRECISION is not None,
+            "REFERENCE_SCORES": bool(REFERENCE_SCORES),
+            "RESULT_CACHE": bool(RESULT_CACHE),
+            "CHECKPOINTS": bool(CHECKPOINTS),
+            "KEEP_SCORES": not KEEP_SCORES,
+        }
+        names = [name for name, is_set in unsupported.items() if is_set]
+        if names:
+            mode = "TRIALS_PER_ANSWER" if TRIALS_PER_ANSWER else "TILT"
+            raise ValueError(
+                f"{mode} cannot be combined with {', '.join(names)}: set "
+                "PRECISION, REFERENCE_SCORES, RESULT_CACHE and CHECKPOINTS to None, "
+                "and KEEP_SCORES to True")
+    start_time = datetime.now().strftime("%Y-%m-%d-%Hh%Mm%Ss")
     Path("results").mkdir(exist_ok=True)
-    output_path = f"results/results-{time}.csv"
+    output_path = f"results/results-{start_time}.csv"
     with open(output_path, "a") as output:
-        output.write("strategy;p05;p50;p95;timeouts\n")
-    for strat in STRATEGIES_UNDER_TEST:
+        header = "strategy;p05;p50;p95;timeouts"
+        if TRIALS_PER_ANSWER or TILT:
+            header += ";p05_ci;p50_ci;p95_ci"
+        # For each move, the p50/p99/max latency in seconds, separated by spaces
+        header += ";move_latencies"
+        # Differences with the first strategy, with their 95% confidence intervals
+        header += ";p05_diff;p50_diff;p95_diff"
+        output.write(header + "\n")
+    seed = SEED if SEED is not None else random.randrange(2**32)
+    print(f"Seed: {seed}")
+    baseline = None
+    for index, strat in enumerate(sys.argv[1:] or STRATEGIES_UNDER_TEST):
         print(f"Testing strategy {strat}…")
-        (scores, p05, p50, p95, timeouts) = evaluate(strat, NUM_TRIALS)
+        strat = registry.resolve(strat)
+        log = f"results/games-{start_time}-{index}.log" if LOG_GAMES else None
+        profile = f"results/profile-{start_time}-{index}.folded" if PROFILE else None
+        checkpoint = None
+        if CHECKPOINTS:
+            # Rerunning with the same strategies resumes their evaluations
+            Path(CHECKPOINTS).mkdir(parents=True, exist_ok=True)
+            checkpoint = f"{CHECKPOINTS}/{strat}.log"
+        latencies = MoveLatencies()
+        if TRIALS_PER_ANSWER:
+            (scores, p05, p50, p95, timeouts, intervals) = evaluate_stratified(
+                strat, TRIALS_PER_ANSWER, workers=NUM_WORKERS, seed=seed, log=log,
+                latencies=latencies, batched=BATCHED, profile=profile)
+        elif TILT:
+            (scores, _, p05, p50, p95, timeouts, intervals) = evaluate_tilted(
+                strat, NUM_TRIALS, TILT, workers=NUM_WORKERS, seed=seed, log=log,
+                latencies=latencies, batched=BATCHED, profile=profile)
+        else:
+            (scores, p05, p50, p95, timeouts) = evaluate(
+                strat, NUM_TRIALS, workers=NUM_WORKERS, seed=seed,
+                precision=PRECISION, reference=REFERENCE_SCORES, log=log,
+                latencies=latencies, cache=RESULT_CACHE, keep_scores=KEEP_SCORES,
+                profile=profile, checkpoint=checkpoint, batched=BATCHED)
         print(f"5th percentile: {p05}")
         print(f"50th percentile: {p50}")
         print(f"95th percentile: {p95}")
         print(f"timeouts: {timeouts}")
+        line = f"{strat};{p05};{p50};{p95};{timeouts}"
+        if TRIALS_PER_ANSWER or TILT:
+            for q, (variance, low, high) in intervals.items():
+                print(f"{q:.0%} quantile: 95% CI [{low}, {high}], CDF variance {variance:.3g}")
+                line += f";[{low}, {high}]"
+        move_latencies = []
+        if BATCHED and is_batched(strat):
+            print("Move latencies are averages over the games of each batched call; "
+                  "set BATCHED = False to measure each game")
+        for move, (p50, p99, max_latency) in enumerate(latencies.summary()):
+            print(f"move {move} latency: p50={p50:.3g}s, p99={p99:.3g}s, max={max_latency:.3g}s")
+            move_latencies.append(f"{p50:.3g}/{p99:.3g}/{max_latency:.3g}")
+        line += ";" + " ".join(move_latencies)
+        if TILT or (not KEEP_SCORES and not TRIALS_PER_ANSWER):
+            # Weighted scores and sketches cannot be compared in pairs
+            line += ";;;"
+        elif baseline is None:
+            baseline = (strat, scores)
+            line += ";;;"
+        else:
+            for q, (difference, low, high) in compare(scores, baseline[1]).items():
+                print(f"{q:.0%} quantile vs {baseline[0]}: {difference:+} (95% CI [{low:+}, {high:+}])")
+                line += f";{difference} [{low}, {high}]"
         with open(output_path, "a") as output:
-            output.write(f"{strat};{p05};{p50};{p95};{timeouts}\n")
-
-
-
-
-
-
-
-
+            output.write(line + "\n")
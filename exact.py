@@ -0,0 +1,130 @@
+# Exact evaluation of deterministic strategies.
+#
+# A deterministic strategy's moves only depend on the clues it received so far,
+# so its games form a decision tree with NUM_CLUES branches per move. Instead of
+# sampling games, we walk this whole tree, and weight each final guess by the
+# probability of receiving the clues leading to it when the final guess is the
+# secret word. This gives the exact probability of winning with each score.
+#
+# Usage: python exact.py
+
+from collections import defaultdict
+
+import numpy as np
+
+import engine
+from engine import NUM_CLUES
+
+# Number of decision tree nodes passed to the strategy at once
+CHUNK_SIZE = 2**14
+
+# answer_indices[g] is the index in `answers.txt` of the g-th word of
+# `valid.txt`, or -1 if this word is not a possible answer
+answer_indices = np.full(len(engine.valid_words), -1)
+answer_indices[engine.answer_guesses] = np.arange(len(engine.answers))
+
+def evaluate_exact(strategy, max_moves=10):
+    """Computes the exact score distribution of a deterministic strategy.
+
+    `strategy` must implement the batched protocol natively (see
+    `evaluate.play_batch`), with states that can be indexed along their first
+    axis, and its moves must only depend on the clues received so far. Each
+    prefix of a game is only passed to the strategy once, and shared by all the
+    games starting with it.
+
+    The running time is proportional to the number of decision tree nodes,
+    which is NUM_CLUES to the power of the number of moves, and to the cost of
+    each move of the strategy. For example, this takes seconds for G3, but hours
+    for D95, whose third move is expensive.
+
+    Returns a tuple with five elements: the probability of winning, the 5th,
+    50th, and 95th percentiles of the score, and a dictionary mapping each
+    finite score to the probability of winning with this score.
+    """
+    if not hasattr(strategy, "first_moves"):
+        raise ValueError(f"strategy {strategy} does not implement the batched protocol")
+    distribution = defaultdict(float)
+    states, guesses, epsilons = strategy.first_moves(1)
+    if np.asarray(states).dtype == object:
+        raise ValueError(f"strategy {strategy} does not have indexable states")
+    no_moves = np.zeros((1, 0))
+    _explore(
+        strategy, states, guesses, epsilons,
+        no_moves.astype(np.int64), no_moves, no_moves.astype(np.uint8),
+        distribution, max_moves,
+    )
+    distribution = dict(sorted(distribution.items()))
+    return (
+        sum(distribution.values()),
+        distribution_quantile(distribution, 0.05),
+        distribution_quantile(distribution, 0.5),
+        distribution_quantile(distribution, 0.95),
+        distribution,
+    )
+
+def distribution_quantile(distribution, q):
+    """Returns the smallest score whose probability of being reached or
+    beaten is at least `q`, given the probability of winning with each score."""
+    cumulative = 0
+    for score in sorted(distribution):
+        cumulative += distribution[score]
+        if cumulative >= q:
+            return score
+    return float('inf')
+
+def _explore(strategy, states, guesses, epsilons, past_guesses, past_epsilons,
+             past_clues, distribution, max_moves):
+    """Explores the subtrees of a group of nodes, given the strategy's states and
+    moves at these nodes, and the moves and clues leading to them. Adds the
+    probability of winning with each score to `distribution`."""
+    guesses = np.asarray(guesses)
+    epsilons = np.asarray(epsilons, dtype=np.float64)
+    # Invalid guesses lose the game
+    valid = (guesses >= 0) & (guesses < len(engine.valid_words))
+    final = valid & (epsilons <= 0)
+    _add_wins(guesses[final], past_guesses[final], past_epsilons[final],
+              past_clues[final], distribution)
+
+    playing = np.flatnonzero(valid & (epsilons > 0))
+    if len(playing) == 0:
+        return
+    if past_guesses.shape[1] + 1 >= max_moves:
+        raise ValueError(f"strategy {strategy} played more than {max_moves} moves")
+    parents_per_chunk = max(1, CHUNK_SIZE // NUM_CLUES)
+    for start in range(0, len(playing), parents_per_chunk):
+        parents = np.repeat(playing[start:start + parents_per_chunk], NUM_CLUES)
+        clues = np.tile(np.arange(NUM_CLUES, dtype=np.uint8), len(parents) // NUM_CLUES)
+        child_states, child_guesses, child_epsilons = strategy.next_moves(
+            states[parents], clues)
+        _explore(
+            strategy, child_states, child_guesses, child_epsilons,
+            np.column_stack([past_guesses[parents], guesses[parents]]),
+            np.column_stack([past_epsilons[parents], epsilons[parents]]),
+            np.column_stack([past_clues[parents], clues]),
+            distribution, max_moves,
+        )
+
+def _add_wins(final_guesses, past_guesses, past_epsilons, past_clues, distribution):
+    secrets = answer_indices[final_guesses]
+    winnable = secrets >= 0
+    secrets = secrets[winnable]
+    # Probability of receiving these clues, if the final guess is the secret
+    probabilities = np.full(len(secrets), 1. / len(engine.answers))
+    for t in range(past_guesses.shape[1]):
+        real_clues = engine.clue_table()[past_guesses[winnable, t], secrets]
+        probabilities *= engine.clue_likelihoods(
+            real_clues, past_clues[winnable, t], past_epsilons[winnable, t])
+    scores = np.sum(past_epsilons[winnable], axis=1)
+    for score in np.unique(scores):
+        distribution[score.item()] += np.sum(probabilities[scores == score]).item()
+
+if __name__ == "__main__":
+    from strategies.g3 import G3
+
+    strategy = G3(epsilon1=9.3, epsilon2=5.3)
+    win_probability, p05, p50, p95, _ = evaluate_exact(strategy)
+    print(f"Strategy {strategy}")
+    print(f"Probability of winning: {win_probability}")
+    print(f"5th percentile: {p05}")
+    print(f"50th percentile: {p50}")
+    print(f"95th percentile: {p95}")
@@ -0,0 +1,137 @@
+# An append-only, columnar file format to store the results of every game of an
+# evaluation, so they can be analyzed later without replaying the games.
+#
+# A game log is a sequence of chunks. Each chunk is a series of arrays written
+# with `np.save`, one per column: first the GAME_COLUMNS, with one entry per
+# game, then the MOVE_COLUMNS, with one entry per move of each game, in order.
+# Games are buffered in memory until a chunk is full, so memory use does not
+# grow with the number of games. Each chunk is written to the file at once, so
+# an interrupted evaluation (e.g. with Ctrl-C) can at worst leave an incomplete
+# chunk at the end of the log, which `repair` discards.
+
+import io
+
+import numpy as np
+
+# Name and type of the per-game columns. Secrets are indices in `answers.txt`,
+# and timeout_move is -1 for games that did not time out.
+GAME_COLUMNS = {
+    "secret": np.int16,
+    "score": np.float64,
+    "timeout_move": np.int16,
+    "num_moves": np.uint16,
+}
+# Name and type of the per-move columns. Guesses are indices in `valid.txt`
+# (-1 for invalid words), and clues are clue codes (255 if there was no clue,
+# e.g. for the final guess).
+MOVE_COLUMNS = {
+    "guess": np.int16,
+    "epsilon": np.float64,
+    "clue": np.uint8,
+    "wall_time": np.float32,
+    "cpu_time": np.float32,
+}
+
+class GameLog:
+    """Appends the results of games (`evaluate.GameResult` objects) to a game
+    log file. Can be used as a context manager, which closes the file."""
+
+    def __init__(self, path, chunk_size=4096):
+        self.file = open(path, "ab")
+        self.chunk_size = chunk_size
+        self.games = {column: [] for column in GAME_COLUMNS}
+        self.moves = {column: [] for column in MOVE_COLUMNS}
+
+    def write(self, result):
+        num_moves = max(len(result.guesses), len(result.wall_times))
+        timeout_move = -1 if result.timeout_move is None else result.timeout_move
+        moves = {
+            "guess": (result.guesses, -1),
+            "epsilon": (result.epsilons, np.nan),
+            "clue": (result.clues, 255),
+            "wall_time": (result.wall_times, np.nan),
+            "cpu_time": (result.cpu_times, np.nan),
+        }
+        for column, (values, missing) in moves.items():
+            self.moves[column].extend(values[:num_moves])
+            self.moves[column].extend([missing] * (num_moves - len(values)))
+        # The game only counts once its number of moves is appended (see `flush`)
+        self.games["secret"].append(result.secret)
+        self.games["score"].append(result.score)
+        self.games["timeout_move"].append(timeout_move)
+        self.games["num_moves"].append(num_moves)
+        if len(self.games["score"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered games to the file as one chunk, with a single
+        write, and only then removes them from the buffer. A game whose `write`
+        was interrupted is discarded."""
+        num_games = len(self.games["num_moves"])
+        if num_games:
+            num_moves = sum(self.games["num_moves"])
+            buffer = io.BytesIO()
+            for column, dtype in GAME_COLUMNS.items():
+                np.save(buffer, np.array(self.games[column][:num_games], dtype=dtype))
+            for column, dtype in MOVE_COLUMNS.items():
+                np.save(buffer, np.array(self.moves[column][:num_moves], dtype=dtype))
+            self.file.write(buffer.getbuffer())
+            self.file.flush()
+        for columns in (self.games, self.moves):
+            for values in columns.values():
+                values.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_chunks(path):
+    """Yields the chunks of a game log, as `(games, moves)` pairs of
+    dictionaries mapping column names to arrays."""
+    with open(path, "rb") as f:
+        while f.peek(1):
+            games = {column: np.load(f) for column in GAME_COLUMNS}
+            moves = {column: np.load(f) for column in MOVE_COLUMNS}
+            yield games, moves
+
+def read_game_log(path):
+    """Reads a whole game log, and returns a `(games, moves)` pair of
+    dictionaries mapping column names to arrays. The moves of game i are at
+    indices `offsets[i]` to `offsets[i+1]` of the move columns, where
+    `offsets` is the cumulative sum of `games["num_moves"]`, starting at 0."""
+    chunks = list(read_chunks(path))
+    games = {
+        column: np.concatenate([chunk[0][column] for chunk in chunks])
+        if chunks else np.zeros(0, dtype=dtype)
+        for column, dtype in GAME_COLUMNS.items()
+    }
+    moves = {
+        column: np.concatenate([chunk[1][column] for chunk in chunks])
+        if chunks else np.zeros(0, dtype=dtype)
+        for column, dtype in MOVE_COLUMNS.items()
+    }
+    return games, moves
+
+def repair(path):
+    """Truncates a game log after its last complete chunk, e.g. if the process
+    writing it was killed while writing a chunk. Returns the number of complete
+    chunks."""
+    chunks = 0
+    with open(path, "r+b") as f:
+        end = 0
+        try:
+            while f.peek(1):
+                for _ in range(len(GAME_COLUMNS) + len(MOVE_COLUMNS)):
+                    np.load(f)
+                chunks += 1
+                end = f.tell()
+        except (EOFError, ValueError):
+            print(f"Discarding an incomplete chunk at the end of {path}")
+            f.truncate(end)
+    return chunks
@@ -1,4 +1,7 @@
+import sys
+
 from evaluate import evaluate_once
+import registry
 
 with open("valid.txt", "r") as f:
   valid = set(f.read().splitlines())
@@ -40,5 +43,10 @@ class Interactive:
         return guess, epsilon
 
 if __name__ == "__main__":
-    strategy = Interactive()
-    score = evaluate_once(strategy, end_message=True)
+    if len(sys.argv) > 1:
+        # Watch a strategy play, e.g. `python interactive.py "G3(epsilon1=9.3, epsilon2=5.3)"`
+        strategy = registry.load(sys.argv[1])
+        score = evaluate_once(strategy, debug=True, end_message=True)
+    else:
+        strategy = Interactive()
+        score = evaluate_once(strategy, end_message=True)
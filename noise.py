@@ -0,0 +1,92 @@
+# The noise model of the game: each letter of a clue is replaced by a uniformly
+# random clue with probability 3/(2+e^(ε/5)), independently of the others. So the
+# probability of getting a noisy clue only depends on its number of letters that
+# differ from the real clue (see `engine.clue_distances`).
+#
+# The tables of probabilities of each noisy clue given each real clue are
+# computed with array operations, and cached per epsilon value: strategies (and
+# sweeps over many epsilon values) share them instead of computing their own.
+#
+# Since letters are randomized independently, the (243, 243) table is the
+# Kronecker product of five (3, 3) tables, one per letter (`letter_channel`).
+# `apply_channel` uses this to multiply vectors of 243 clue weights by the table
+# with five small contractions, about 15 times fewer operations than a dense
+# product.
+
+from functools import lru_cache
+
+import numpy as np
+
+from engine import NUM_CLUES, clue_distances
+
+# Number of epsilon values whose tables are kept in memory
+CACHE_SIZE = 256
+
+def letter_probabilities(epsilon):
+    """Returns the `(p_same, p_other)` probabilities that a letter of a noisy
+    clue is the real one, and that it is a particular other one."""
+    p_other = 1. / (2. + np.exp(epsilon / 5.))
+    return 1. - 2. * p_other, p_other
+
+def distance_likelihoods(epsilon):
+    """Returns the (6,) array of the probabilities of getting a particular noisy
+    clue that differs from the real clue by 0, 1, …, 5 letters."""
+    p_same, p_other = letter_probabilities(epsilon)
+    differences = np.arange(6)
+    return p_same ** (5 - differences) * p_other ** differences
+
+@lru_cache(maxsize=CACHE_SIZE)
+def likelihoods(epsilon):
+    """
+    likelihoods(epsilon)[real][noisy]: the probability of getting a noisy clue
+    given the real clue, as a read-only (243, 243) array
+
+    The table is symmetric, so it is also indexed by [noisy][real].
+    """
+    table = distance_likelihoods(epsilon)[clue_distances]
+    table.setflags(write=False)
+    return table
+
+@lru_cache(maxsize=CACHE_SIZE)
+def log_likelihoods(epsilon):
+    """The logarithm of `likelihoods(epsilon)`, as a read-only array; it is
+    -inf for impossible noisy clues (when epsilon is infinite)."""
+    with np.errstate(divide="ignore"):
+        table = np.log(distance_likelihoods(epsilon))[clue_distances]
+    table.setflags(write=False)
+    return table
+
+@lru_cache(maxsize=CACHE_SIZE)
+def letter_channel(epsilon):
+    """
+    letter_channel(epsilon)[real][noisy]: the probability of getting a noisy
+    clue for a letter given its real clue, as a read-only (3, 3) array
+    """
+    p_same, p_other = letter_probabilities(epsilon)
+    channel = np.full((3, 3), p_other)
+    np.fill_diagonal(channel, p_same)
+    channel.setflags(write=False)
+    return channel
+
+def apply_channel(vectors, epsilon, transpose=False):
+    """Multiplies vectors of clue weights by the likelihood table.
+
+    `vectors` is an array whose last axis has 243 entries, one per clue. By
+    default, it holds weights of the real clues (e.g. their probabilities), and
+    the result holds the resulting weights of the noisy clues:
+    result[..., noisy] = sum(vectors[..., real] * likelihoods[real][noisy]).
+    With `transpose`, it holds weights of the noisy clues, and the result holds
+    result[..., real] = sum(likelihoods[real][noisy] * vectors[..., noisy]),
+    e.g. the likelihood of each real clue given a noisy clue.
+    """
+    channel = letter_channel(epsilon)
+    if transpose:
+        channel = channel.T
+    vectors = np.asarray(vectors, dtype=np.float64)
+    result = vectors.reshape(-1, 3, NUM_CLUES // 3)
+    for _ in range(5):
+        # Mixes the three values of the first letter's digit, and moves this
+        # digit last, so the next letter's digit comes first
+        result = result.transpose(0, 2, 1).reshape(-1, 3) @ channel
+        result = result.reshape(-1, 3, NUM_CLUES // 3)
+    return result.reshape(vectors.shape)
@@ -0,0 +1,77 @@
+# A sampling profiler for the moves of strategies.
+#
+# While profiling, the process receives a SIGPROF signal every SAMPLING_INTERVAL
+# seconds of CPU time. If a move is being played (see `sampling`), the signal
+# handler records the current call stack. The samples are counted per stack,
+# can be merged across worker processes, and are written in the "folded" format
+# used by flamegraph tools (flamegraph.pl, inferno, speedscope): one line per
+# stack, with the frames separated by semicolons from the outermost one, and the
+# number of samples. Stacks start at the function playing the move, so they do
+# not depend on how the games were scheduled.
+
+from collections import Counter
+from contextlib import contextmanager
+import os
+import signal
+import sys
+
+# CPU time (in seconds) between two samples
+SAMPLING_INTERVAL = 0.001
+
+# Samples recorded in the current process, if it is being profiled
+_samples = None
+# Frame of the function playing the current move, if a move is being played
+_root = None
+
+def _frame_name(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+
+def _record(signum, frame):
+    if _root is None:
+        return
+    stack = []
+    while frame is not None and frame is not _root:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.append(_frame_name(_root))
+    _samples[";".join(reversed(stack))] += 1
+
+@contextmanager
+def sampling():
+    """Context manager enabling the sampling of the stack during a move, if the
+    current process is being profiled."""
+    global _root
+    if _samples is None:
+        yield
+        return
+    # The frame of the `with` statement, below the one of contextlib
+    _root = sys._getframe(2)
+    try:
+        yield
+    finally:
+        _root = None
+
+def profile_call(function, interval=SAMPLING_INTERVAL):
+    """Calls `function` while profiling the current process, which must be
+    done in the main thread. Returns a tuple `(result, samples)`, where
+    `samples` is a Counter of the number of samples of each folded stack."""
+    global _samples
+    _samples = Counter()
+    previous_handler = signal.signal(signal.SIGPROF, _record)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        result = function()
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous_handler)
+        samples, _samples = _samples, None
+    return result, samples
+
+def write_folded(samples, path):
+    """Writes the samples in the folded format of flamegraph tools, the most
+    frequent stacks first."""
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
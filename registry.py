@@ -0,0 +1,44 @@
+# A registry of the strategies of the `strategies` directory, which only imports
+# the module of a strategy (and builds its tables) when it is used.
+#
+# Strategies are described by specs with the same syntax as their `__str__`,
+# e.g. "G3(epsilon1=9.3, epsilon2=5.3)": the name of a registered class, and
+# literal arguments for its constructor.
+
+import ast
+import importlib
+
+# Name of each strategy class, and the module defining it
+STRATEGIES = {
+    "BayesianGreedy": "strategies.bayesian_greedy",
+    "BayesianRandom": "strategies.bayesian_random",
+    "BayesianWordle": "strategies.bayesian_wordle",
+    "D95": "strategies.d95",
+    "G3": "strategies.g3",
+    "MaxClueEntropy": "strategies.max_clue_entropy",
+    "NGuess": "strategies.n_guess",
+    "TwoGuess": "strategies.two_guess",
+}
+
+def strategy_class(name):
+    """Imports and returns the registered strategy class called `name`."""
+    if name not in STRATEGIES:
+        raise ValueError(f"unknown strategy '{name}', expected one of {', '.join(STRATEGIES)}")
+    return getattr(importlib.import_module(STRATEGIES[name]), name)
+
+def load(spec):
+    """Builds the strategy described by `spec`, e.g. "D95(epsilon=12.3)". A
+    spec without arguments can omit the parentheses."""
+    call = ast.parse(spec.strip(), mode="eval").body
+    if isinstance(call, ast.Name):
+        return strategy_class(call.id)()
+    if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Name):
+        raise ValueError(f"invalid strategy spec '{spec}'")
+    args = [ast.literal_eval(arg) for arg in call.args]
+    kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords}
+    return strategy_class(call.func.id)(*args, **kwargs)
+
+def resolve(strategy):
+    """Returns `strategy` if it is already a strategy object, or builds it if it
+    is a spec."""
+    return load(strategy) if isinstance(strategy, str) else strategy
@@ -0,0 +1,101 @@
+# A cache of evaluation results, so that evaluating a strategy that has not
+# changed does not play its games again.
+#
+# The results of the games played by a strategy with a given seed are stored in
+# a game log (see game_log.py), named after a hash of everything they depend on:
+# the strategy's parameters, the source code of its modules and of the engine
+# (see `source_hash`), the word lists, the time limit, the number of games
+# played at once, and the seed. The i-th trial of an evaluation does not depend
+# on the number of trials, so an evaluation with more trials than the cached
+# ones only plays the missing games, and appends them to the log.
+
+import ast
+import hashlib
+import inspect
+from pathlib import Path
+import sys
+
+# Bump this when changing the game engine in a way that changes the results
+CACHE_VERSION = 1
+# Directory of the repository, whose modules are part of the key
+ROOT = Path(__file__).resolve().parent
+# Modules the results of every strategy depend on, besides its own
+ENGINE_FILES = ("engine.py", "noise.py", "evaluate.py")
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def local_imports(path):
+    """Returns the set of paths of the modules of the repository imported at the
+    top level of the Python file at `path`, directly or not, including `path`
+    itself. Imports inside functions (e.g. of `evaluate` in the checks run by
+    `engine.py`) are not followed."""
+    found = set()
+    pending = [Path(path).resolve()]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.add(path)
+        names = []
+        for node in ast.parse(path.read_text()).body:
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names.append(node.module)
+                # The imported names may be submodules of a package
+                names.extend(f"{node.module}.{alias.name}" for alias in node.names)
+        for name in names:
+            for candidate in (f"{name.replace('.', '/')}.py",
+                              f"{name.replace('.', '/')}/__init__.py"):
+                if (ROOT / candidate).is_file():
+                    pending.append(ROOT / candidate)
+    return found
+
+def source_hash(strategy):
+    """Returns the hash of the source code `strategy` depends on: the module
+    defining its class (and those of the strategies it wraps, if any), the
+    modules of the repository they import, directly or not, and the
+    ENGINE_FILES. Returns None if the source of its class is not available."""
+    classes = [type(strategy)] + [
+        type(value) for value in getattr(strategy, "__dict__", {}).values()
+        if hasattr(value, "first_move")
+    ]
+    paths = {ROOT / name for name in ENGINE_FILES}
+    try:
+        for cls in classes:
+            paths |= local_imports(inspect.getsourcefile(sys.modules[cls.__module__]))
+    except (KeyError, OSError, TypeError):
+        return None
+    key = hashlib.sha256()
+    for path in sorted(paths):
+        key.update(file_hash(path).encode())
+    return key.hexdigest()
+
+def cache_path(directory, strategy, seed, time_limit, group_size=1):
+    """Returns the path of the game log caching the results of `strategy` for
+    `seed` in `directory`, when playing `group_size` games at once (which
+    changes how moves are timed), or None if they cannot be cached: when the
+    seed is None, when the source code of the strategy is not available, or
+    when its `repr` does not describe its parameters (e.g. the default `object`
+    one)."""
+    source = source_hash(strategy)
+    if seed is None or source is None or " object at 0x" in repr(strategy):
+        return None
+    key = hashlib.sha256()
+    parts = (
+        CACHE_VERSION,
+        repr(strategy),
+        str(strategy),
+        source,
+        file_hash("valid.txt"),
+        file_hash("answers.txt"),
+        time_limit,
+        group_size,
+        seed,
+    )
+    for part in parts:
+        key.update(repr(part).encode() + b"\0")
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    return Path(directory) / f"{key.hexdigest()}.log"
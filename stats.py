@@ -0,0 +1,289 @@
+# Estimators and confidence intervals for the score quantiles of a strategy.
+#
+# Scores can be infinite (when the strategy loses), so the intervals below are
+# computed on the empirical distribution of the scores, which handles infinite
+# values naturally, rather than relying on interpolation.
+
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+def ecdf_quantile(scores, p):
+    """Returns the smallest score s such that a fraction at least `p` of the
+    scores is at most s. `p` is clipped to [0, 1]."""
+    scores = np.sort(np.asarray(scores, dtype=np.float64), axis=None)
+    i = math.ceil(min(max(p, 0), 1) * len(scores)) - 1
+    return scores[max(i, 0)]
+
+def cdf_indicator(scores, estimate):
+    """Returns whether each score is at most the estimated quantile. When the
+    estimate is infinite, the CDF is trivially 1 there, so its variance would be
+    0 and the confidence interval [inf, inf]; the CDF is then taken just below
+    infinity (at the largest finite score) instead, so the interval can include
+    finite scores."""
+    return scores < estimate if estimate == math.inf else scores <= estimate
+
+def stratified_quantile_interval(scores, q, confidence=0.95):
+    """Computes a confidence interval for the `q`-quantile of stratified scores.
+
+    `scores` is a (strata, trials) array: each row holds the scores of the games
+    played with one secret word, and all secret words are equally likely.
+
+    The variance of the estimated CDF at the quantile is the weighted sum of the
+    per-stratum variances. The interval is obtained by inverting the CDF at
+    `q` ± z standard deviations (Woodruff's method).
+
+    Returns a tuple `(variance, low, high)`, where `variance` is the estimated
+    variance of the CDF of the scores at the estimated quantile.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    num_strata, trials = scores.shape
+    estimate = ecdf_quantile(scores, q)
+    below = np.mean(cdf_indicator(scores, estimate), axis=1)
+    if trials > 1:
+        # Unbiased per-stratum variances of the indicator
+        stratum_variances = below * (1 - below) * trials / (trials - 1)
+        variance = np.sum(stratum_variances) / (num_strata**2 * trials)
+    else:
+        # Within-stratum variances cannot be estimated from a single game, so
+        # we fall back to the variance of unstratified sampling, which is
+        # always at least as large.
+        variance = np.mean(below) * (1 - np.mean(below)) / num_strata
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    margin = z * math.sqrt(variance)
+    return (
+        variance,
+        ecdf_quantile(scores, q - margin),
+        ecdf_quantile(scores, q + margin),
+    )
+
+def weighted_quantile(scores, weights, q):
+    """Returns the smallest score s such that the weighted fraction of the
+    scores at most s is at least `q`, the weights being normalized to sum to
+    1."""
+    scores = np.asarray(scores, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    order = np.argsort(scores, kind="stable")
+    cdf = np.cumsum(weights[order]) / np.sum(weights)
+    i = np.searchsorted(cdf, min(max(q, 0), 1) * (1 - 1e-12))
+    return scores[order[min(i, len(scores) - 1)]]
+
+def weighted_quantile_interval(scores, weights, q, confidence=0.95):
+    """Computes a confidence interval for the `q`-quantile of scores obtained
+    by importance sampling, the i-th score having the likelihood ratio
+    `weights[i]`.
+
+    The CDF of the scores is estimated by normalizing the weights to sum to 1
+    (the self-normalized estimator), and its variance at the estimated quantile
+    with the delta method. Like in `stratified_quantile_interval`, the interval
+    is obtained by inverting the CDF at `q` ± z standard deviations.
+
+    Returns a tuple `(variance, low, high)`, where `variance` is the estimated
+    variance of the CDF of the scores at the estimated quantile.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    estimate = weighted_quantile(scores, weights, q)
+    below = cdf_indicator(scores, estimate)
+    cdf = np.sum(weights[below]) / np.sum(weights)
+    variance = np.sum((weights * (below - cdf)) ** 2) / np.sum(weights) ** 2
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    margin = z * math.sqrt(variance)
+    return (
+        variance,
+        weighted_quantile(scores, weights, q - margin),
+        weighted_quantile(scores, weights, q + margin),
+    )
+
+def quantile_interval(scores, q, confidence=0.95):
+    """Computes a distribution-free confidence interval for the `q`-quantile of
+    the distribution the scores were sampled from.
+
+    The bounds are order statistics of the scores, whose ranks are chosen using
+    the normal approximation of the binomial distribution. When there are too
+    few scores to bound the quantile on one side, this bound is infinite; when
+    the quantile is infinite, so is the interval. `scores` can also be a
+    QuantileSketch, in which case the bounds are approximate.
+
+    Returns a tuple `(low, high)`.
+    """
+    if isinstance(scores, QuantileSketch):
+        n = scores.count()
+        order_statistic = scores.value_at_rank
+    else:
+        sorted_scores = np.sort(np.asarray(scores, dtype=np.float64))
+        n = len(sorted_scores)
+        order_statistic = lambda rank: sorted_scores[rank - 1]
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    spread = z * math.sqrt(n * q * (1 - q))
+    # 1-based ranks of the bounds
+    low_rank = math.floor(n * q - spread)
+    high_rank = math.ceil(n * q + spread) + 1
+    low = order_statistic(low_rank) if low_rank >= 1 else -math.inf
+    high = order_statistic(high_rank) if high_rank <= n else math.inf
+    return low, high
+
+def paired_quantile_difference(scores, baseline, q, confidence=0.95,
+                               resamples=1000, seed=0):
+    """Computes a confidence interval for the difference between the
+    `q`-quantiles of two strategies evaluated on the same trials.
+
+    `scores` and `baseline` have the same length, and their i-th elements are
+    the scores of the same trial, played with the same secret word and noise
+    draws (see `evaluate.trial_generator`). The interval is obtained with a
+    paired bootstrap: trials are resampled with replacement, keeping both scores
+    of each trial together, so the variance shared by both strategies cancels
+    out. The difference between two infinite quantiles is 0.
+
+    Returns a tuple `(difference, low, high)`.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    baseline = np.asarray(baseline, dtype=np.float64)
+    n = len(scores)
+    rank = max(math.ceil(min(max(q, 0), 1) * n) - 1, 0)
+    rng = np.random.default_rng(seed)
+    differences = []
+    # Resample in chunks, to bound the memory used with many trials
+    chunk_size = max(1, 2**22 // max(n, 1))
+    for start in range(0, resamples, chunk_size):
+        size = min(chunk_size, resamples - start)
+        samples = rng.integers(n, size=(size, n))
+        differences.append(_difference(
+            np.sort(scores[samples], axis=1)[:, rank],
+            np.sort(baseline[samples], axis=1)[:, rank],
+        ))
+    differences = np.concatenate(differences)
+    alpha = 1 - confidence
+    low, high = np.quantile(
+        differences, [alpha / 2, 1 - alpha / 2], method="inverted_cdf")
+    difference = _difference(ecdf_quantile(scores, q), ecdf_quantile(baseline, q))
+    return float(difference), float(low), float(high)
+
+def _difference(a, b):
+    with np.errstate(invalid="ignore"):
+        return np.where(a == b, 0., np.subtract(a, b))
+
+def interval_width(low, high):
+    """Returns the width of an interval, which is 0 if both bounds are
+    infinite."""
+    if low == high:
+        return 0.
+    return high - low
+
+class LatencyHistogram:
+    """A histogram of latencies (in seconds) with logarithmic buckets, in the
+    style of HDR histograms: percentiles are reported with a relative error of
+    at most RELATIVE_ERROR, using constant memory. Histograms can be merged,
+    e.g. to combine the measurements of several processes."""
+
+    RELATIVE_ERROR = 0.01
+    # Latencies below MIN_LATENCY or above MAX_LATENCY are clamped
+    MIN_LATENCY = 1e-7
+    MAX_LATENCY = 1e4
+
+    def __init__(self):
+        self.ratio = 1 + 2 * self.RELATIVE_ERROR
+        size = self._bucket(self.MAX_LATENCY) + 1
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.max = 0.
+
+    def _bucket(self, latency):
+        latency = min(max(latency, self.MIN_LATENCY), self.MAX_LATENCY)
+        return int(math.log(latency / self.MIN_LATENCY) / math.log(self.ratio))
+
+    def record(self, latency):
+        self.counts[self._bucket(latency)] += 1
+        self.max = max(self.max, latency)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.max = max(self.max, other.max)
+
+    def count(self):
+        return int(np.sum(self.counts))
+
+    def percentile(self, q):
+        """Returns the `q`-quantile of the recorded latencies, e.g. q=0.99 for the
+        99th percentile."""
+        if self.count() == 0:
+            return math.nan
+        bucket = np.searchsorted(np.cumsum(self.counts), q * self.count())
+        # The middle of the bucket, in logarithmic scale
+        latency = self.MIN_LATENCY * self.ratio ** (bucket + 0.5)
+        return min(latency, self.max)
+
+class QuantileSketch:
+    """A summary of a stream of scores, from which quantiles can be estimated
+    with a relative error of at most RELATIVE_ERROR, using constant memory (in
+    the style of DDSketch).
+
+    Scores are counted in logarithmic buckets between MIN_SCORE and MAX_SCORE;
+    smaller scores (e.g. 0) are counted in a separate bucket, as are infinite
+    scores, which are reported exactly. Larger finite scores are clamped to
+    MAX_SCORE. Sketches can be merged, e.g. to combine the scores of several
+    processes.
+    """
+
+    RELATIVE_ERROR = 0.001
+    MIN_SCORE = 1e-3
+    MAX_SCORE = 1e6
+
+    def __init__(self):
+        self.gamma = (1 + self.RELATIVE_ERROR) / (1 - self.RELATIVE_ERROR)
+        size = self._buckets(np.array([self.MAX_SCORE]))[0] + 1
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.small = 0
+        self.infinite = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _buckets(self, scores):
+        # Bucket i holds the scores in (MIN_SCORE*gamma^(i-1), MIN_SCORE*gamma^i]
+        scores = np.minimum(scores, self.MAX_SCORE)
+        buckets = np.ceil(np.log(scores / self.MIN_SCORE) / math.log(self.gamma))
+        return np.maximum(buckets, 0).astype(np.int64)
+
+    def add(self, score):
+        self.add_many([score])
+
+    def add_many(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        infinite = np.isinf(scores)
+        small = scores <= self.MIN_SCORE
+        self.infinite += int(np.count_nonzero(infinite))
+        self.small += int(np.count_nonzero(small & ~infinite))
+        finite = scores[~infinite]
+        if len(finite):
+            self.min = min(self.min, float(np.min(finite)))
+            self.max = max(self.max, float(np.max(finite)))
+        np.add.at(self.counts, self._buckets(scores[~infinite & ~small]), 1)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.small += other.small
+        self.infinite += other.infinite
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def count(self):
+        return self.small + int(np.sum(self.counts)) + self.infinite
+
+    def value_at_rank(self, rank):
+        """Returns an estimate of the `rank`-th smallest score (starting at 1)."""
+        if rank > self.count() - self.infinite:
+            return math.inf
+        if rank <= self.small:
+            return self.min
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank - self.small))
+        # The value of the bucket with the smallest relative error
+        value = self.MIN_SCORE * 2 * self.gamma**bucket / (1 + self.gamma)
+        return min(max(value, self.min), self.max)
+
+    def quantile(self, q):
+        """Returns an estimate of the `q`-quantile of the scores, with the same
+        definition as `ecdf_quantile`."""
+        if self.count() == 0:
+            return math.nan
+        rank = math.ceil(min(max(q, 0), 1) * self.count())
+        return self.value_at_rank(max(rank, 1))
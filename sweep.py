@@ -0,0 +1,105 @@
+# Evaluates a strategy class over a grid of parameter values, e.g. the epsilon
+# values of G3 or D95, and reports the quantiles of each grid point.
+#
+# All instances are built before any game is played: the tables they share
+# (like the clue matrix) are loaded once, each noise table is computed once per
+# epsilon value, and the worker processes inherit all of them. All grid points
+# are evaluated with the same seed, so they play the same secret words with the
+# same noise, and their differences are less noisy than their scores.
+
+from datetime import datetime
+import itertools
+import os
+from pathlib import Path
+import random
+
+from evaluate import RESULT_CACHE, evaluate
+import registry
+from stats import quantile_interval
+
+# The name of the strategy class to evaluate (see `registry.STRATEGIES`), and
+# the values of each of its parameters
+STRATEGY_CLASS = "G3"
+PARAMETER_GRID = {
+    "epsilon1": [8.8, 9.3, 9.8],
+    "epsilon2": [4.8, 5.3, 5.8],
+}
+NUM_TRIALS = 1001
+# Number of processes used to play games in parallel
+NUM_WORKERS = os.cpu_count()
+# Seed shared by all grid points (chosen at random if None)
+SEED = 0
+
+QUANTILES = (0.05, 0.5, 0.95)
+
+def grid_points(grid):
+    """Returns the list of all combinations of parameter values of `grid`, a
+    dictionary mapping parameter names to lists of values, as dictionaries."""
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+def sweep(strategy_class, grid, num_trials, workers=1, seed=None):
+    """Evaluates `strategy_class(**params)` for each combination of parameters
+    in `grid`, using `evaluate` with `num_trials` trials and `workers`
+    processes.
+
+    Returns a list with one `(params, quantiles, timeouts)` tuple per grid
+    point, where `quantiles` maps the 5th, 50th, and 95th percentiles to a
+    `(score, low, high)` tuple; `low` and `high` are the bounds of a 95%
+    confidence interval for the quantile (see `stats.quantile_interval`).
+
+    Grid points that were already evaluated with the same seed are read from
+    the result cache (see `evaluate`).
+    """
+    points = grid_points(grid)
+    strategies = [strategy_class(**params) for params in points]
+    rows = []
+    for params, strategy in zip(points, strategies):
+        print(f"Testing strategy {strategy}…")
+        (scores, p05, p50, p95, timeouts) = evaluate(
+            strategy, num_trials, workers=workers, seed=seed, cache=RESULT_CACHE)
+        quantiles = {
+            q: (score, *quantile_interval(scores, q))
+            for q, score in zip(QUANTILES, (p05, p50, p95))
+        }
+        rows.append((params, quantiles, timeouts))
+    return rows
+
+def format_table(rows):
+    """Formats the results of `sweep` as a text table."""
+    names = list(rows[0][0]) if rows else []
+    header = names + [f"p{q*100:02.0f}" for q in QUANTILES] + ["timeouts"]
+    lines = [header]
+    for params, quantiles, timeouts in rows:
+        line = [str(params[name]) for name in names]
+        for score, low, high in quantiles.values():
+            line.append(f"{score:.4g} [{low:.4g}, {high:.4g}]")
+        line.append(str(timeouts))
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        for line in lines
+    )
+
+if __name__ == "__main__":
+    seed = SEED if SEED is not None else random.randrange(2**32)
+    print(f"Seed: {seed}")
+    strategy_class = registry.strategy_class(STRATEGY_CLASS)
+    rows = sweep(strategy_class, PARAMETER_GRID, NUM_TRIALS, NUM_WORKERS, seed)
+    print(format_table(rows))
+
+    time = datetime.now().strftime("%Y-%m-%d-%Hh%Mm%Ss")
+    Path("results").mkdir(exist_ok=True)
+    with open(f"results/sweep-{time}.csv", "w") as output:
+        names = list(PARAMETER_GRID)
+        output.write(";".join(names + ["p05;p50;p95;timeouts;p05_ci;p50_ci;p95_ci"]) + "\n")
+        for params, quantiles, timeouts in rows:
+            line = [str(params[name]) for name in names]
+            line += [str(score) for score, _, _ in quantiles.values()]
+            line.append(str(timeouts))
+            line += [f"[{low}, {high}]" for _, low, high in quantiles.values()]
+            output.write(";".join(line) + "\n")
@@ -0,0 +1,106 @@
+# Searches the parameters of a strategy class that minimize one quantile of its
+# scores (e.g. the 5th percentile), using successive halving: many parameter
+# settings are first evaluated on a few games, and only the most promising ones
+# are evaluated on more and more games.
+#
+# All settings are evaluated with the same seed, so they play the same secret
+# words with the same noise, and differences between them are less noisy.
+
+import math
+import random
+
+import numpy as np
+
+from evaluate import RESULT_CACHE, evaluate, quantile
+import registry
+
+# The name of the strategy class to tune (see `registry.STRATEGIES`), and the
+# space of its parameters: each parameter is either a list of possible values,
+# or a (low, high) tuple of bounds, in which case values are sampled uniformly
+# and rounded to DECIMALS decimals
+STRATEGY_CLASS = "G3"
+PARAMETER_SPACE = {
+    "epsilon1": (7.0, 12.0),
+    "epsilon2": (3.0, 8.0),
+}
+DECIMALS = 1
+# The quantile to minimize
+TARGET_QUANTILE = 0.05
+NUM_CANDIDATES = 27
+# Number of games played by each candidate in the first round; each round
+# multiplies it by HALVING_RATE, and keeps 1/HALVING_RATE of the candidates
+MIN_TRIALS = 100
+MAX_TRIALS = 2700
+HALVING_RATE = 3
+NUM_WORKERS = 1
+# Seed used to sample candidates and play games (chosen at random if None)
+SEED = None
+
+def sample_candidates(space, num_candidates, rng, decimals=DECIMALS):
+    """Samples up to `num_candidates` distinct parameter settings from `space`
+    (see PARAMETER_SPACE), using the `random.Random` object `rng`."""
+    candidates = []
+    for _ in range(100 * num_candidates):
+        if len(candidates) == num_candidates:
+            break
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                params[name] = round(rng.uniform(*values), decimals)
+            else:
+                params[name] = rng.choice(values)
+        if params not in candidates:
+            candidates.append(params)
+    return candidates
+
+def rank_key(scores, q):
+    """Sort key of a candidate: its `q`-quantile, and then its win rate, to
+    break ties between candidates whose quantile is infinite."""
+    return quantile(scores, q), -np.mean(np.isfinite(scores))
+
+def successive_halving(strategy_class, candidates, q, min_trials=MIN_TRIALS,
+                       max_trials=MAX_TRIALS, rate=HALVING_RATE, workers=1,
+                       seed=None):
+    """Finds the parameter settings among `candidates` (a list of dictionaries
+    of keyword arguments for `strategy_class`) minimizing the `q`-quantile of
+    the scores.
+
+    In each round, the remaining candidates are evaluated on `min_trials`
+    games, then `rate` times more games in the next round, and so on up to
+    `max_trials` games; after each round, only the best `1/rate` of the
+    candidates are kept. Since all evaluations use the same `seed`, the games
+    of a round are the first games of the next one, so they are read from the
+    result cache (see `evaluate`) instead of being played again.
+
+    Returns the list of `(params, quantile, win_rate, trials)` tuples of the
+    candidates of the last round, best first.
+    """
+    trials = min_trials
+    while True:
+        print(f"Evaluating {len(candidates)} candidates on {trials} games each…")
+        results = []
+        for params in candidates:
+            strategy = strategy_class(**params)
+            scores = evaluate(
+                strategy, trials, workers=workers, seed=seed, cache=RESULT_CACHE)[0]
+            results.append((rank_key(scores, q), params))
+        results.sort(key=lambda result: result[0])
+        if len(candidates) == 1 or trials >= max_trials:
+            return [
+                (params, float(score), float(-negative_win_rate), trials)
+                for (score, negative_win_rate), params in results
+            ]
+        candidates = [params for _, params in results[:math.ceil(len(results) / rate)]]
+        trials = min(trials * rate, max_trials)
+
+if __name__ == "__main__":
+    seed = SEED if SEED is not None else random.randrange(2**32)
+    print(f"Seed: {seed}")
+    candidates = sample_candidates(PARAMETER_SPACE, NUM_CANDIDATES, random.Random(seed))
+    strategy_class = registry.strategy_class(STRATEGY_CLASS)
+    results = successive_halving(
+        strategy_class, candidates, TARGET_QUANTILE, workers=NUM_WORKERS, seed=seed)
+    for params, score, win_rate, trials in results:
+        strategy = strategy_class(**params)
+        print(f"{strategy}: {TARGET_QUANTILE:.0%} quantile {score}, "
+              f"win rate {win_rate:.1%} ({trials} games)")
@@ -0,0 +1,168 @@
+# Enforces the time limit of games, without relying on signals.
+#
+# Each game measures the wall and CPU time of its moves with a Stopwatch, and
+# stops as soon as a move makes it exceed its time limit. This works in any
+# thread, but cannot interrupt a move that never returns, e.g. because it is
+# stuck in native code. To also handle these, games can be played in worker
+# processes with `run_tasks`, which kills and replaces the workers that exceed
+# their time limit by more than a grace period.
+
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing.connection import wait
+import time
+
+# Time (in seconds) granted to a worker process after the time limit of its task,
+# before it is killed
+GRACE_PERIOD = 1.0
+
+class GameTimeout(Exception):
+    """Raised when a game exceeds its time limit, during move number `move`
+    (starting at 0)."""
+
+    def __init__(self, move):
+        super().__init__(f"timeout during move {move}")
+        self.move = move
+
+# In worker processes, shared value holding the number of the move currently
+# being played, so the parent process knows it if the worker gets killed
+_current_move = None
+
+class Stopwatch:
+    """Measures the wall and CPU time (in seconds) of each move of a game, and
+    raises GameTimeout when their total wall time exceeds `limit`.
+
+    The CPU time is the one of the whole process, so it includes the time spent
+    in other threads of the strategy (e.g. in numba's parallel loops).
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.wall_times = []
+        self.cpu_times = []
+
+    @contextmanager
+    def move(self):
+        """Context manager measuring the time of one move."""
+        if _current_move is not None:
+            _current_move.value = len(self.wall_times)
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        self.add(time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, wall_time, cpu_time):
+        """Records the time of a move measured elsewhere."""
+        self.wall_times.append(wall_time)
+        self.cpu_times.append(cpu_time)
+        if sum(self.wall_times) > self.limit:
+            raise GameTimeout(len(self.wall_times) - 1)
+
+def set_current_move(move):
+    """Publishes the number of the move currently being played, for tasks that
+    do not use a Stopwatch."""
+    if _current_move is not None:
+        _current_move.value = move
+
+def run_tasks(function, tasks, num_tasks, time_limit, workers, failed_result,
+              initializer=None):
+    """Runs `function` on each of the `num_tasks` tasks of the iterable `tasks`
+    in a pool of `workers` processes, and yields the results in the same order
+    as the tasks. Tasks are only taken from `tasks` when a worker is idle, so
+    they can be generated lazily.
+
+    The workers are forked from the current process, so `function` and the
+    state it depends on are inherited rather than pickled. `time_limit(task)`
+    is the time (in seconds) allowed for each task; workers that exceed it by
+    more than GRACE_PERIOD are killed and replaced. The result of their task is
+    then `failed_result(task, move, True)`, where `move` is the number of the
+    move being played at the time. If a worker dies on its own, the result of
+    its task is `failed_result(task, move, False)`.
+
+    If `initializer` is set, it is called without arguments in each worker
+    process (including the replacements of killed workers) before its first
+    task.
+    """
+    context = multiprocessing.get_context("fork")
+    pending = iter(enumerate(tasks))
+    results = {}
+    next_result = 0
+    idle = []
+    # Maps each busy worker to its task index, task, and deadline
+    busy = {}
+    try:
+        for _ in range(min(workers, num_tasks)):
+            idle.append(_Worker(context, function, initializer))
+        while True:
+            while idle:
+                next_task = next(pending, None)
+                if next_task is None:
+                    break
+                index, task = next_task
+                worker = idle.pop()
+                worker.connection.send(task)
+                deadline = time.monotonic() + time_limit(task) + GRACE_PERIOD
+                busy[worker] = (index, task, deadline)
+            while next_result in results:
+                yield results.pop(next_result)
+                next_result += 1
+            if not busy:
+                return
+            first_deadline = min(deadline for _, _, deadline in busy.values())
+            ready = wait(
+                [worker.connection for worker in busy],
+                timeout=max(0, first_deadline - time.monotonic()),
+            )
+            for worker in list(busy):
+                index, task, deadline = busy[worker]
+                if worker.connection in ready:
+                    try:
+                        results[index] = worker.connection.recv()
+                        del busy[worker]
+                        idle.append(worker)
+                        continue
+                    except EOFError:
+                        print("A worker process died while playing a task")
+                        timed_out = False
+                elif time.monotonic() > deadline:
+                    timed_out = True
+                else:
+                    continue
+                results[index] = failed_result(task, worker.current_move.value, timed_out)
+                del busy[worker]
+                worker.kill()
+                idle.append(_Worker(context, function, initializer))
+    finally:
+        for worker in idle + list(busy):
+            worker.kill()
+
+class _Worker:
+    """A worker process of `run_tasks`."""
+
+    def __init__(self, context, function, initializer):
+        self.connection, child_connection = context.Pipe()
+        self.current_move = context.Value('i', -1, lock=False)
+        self.process = context.Process(
+            target=_work,
+            args=(child_connection, function, self.current_move, initializer),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+def _work(connection, function, current_move, initializer):
+    global _current_move
+    _current_move = current_move
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        current_move.value = -1
+        connection.send(function(task))